@@ -0,0 +1,591 @@
+#!/usr/bin/python3
+
+"""
+Fake Openstack cloud. Serves the parts of keystone, nova, cinder, neutron and octavia the exporter
+uses, with synthetic resources of configurable count and a configurable latency per request.
+
+Resources are not stored but generated from their index when listed, so even clouds with
+hundreds of thousands of volumes need next to no memory.
+"""
+
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+LOGGER = logging.getLogger(__name__)
+
+REGION = 'RegionOne'
+TOKEN = 'fake-token'
+
+# service type -> (catalog name, path prefix, version path)
+SERVICES = {
+    'identity': ('keystone', 'identity', 'v3'),
+    'compute': ('nova', 'compute', 'v2.1'),
+    'block-storage': ('cinderv3', 'volume', 'v3'),
+    'network': ('neutron', 'network', 'v2.0'),
+    'load-balancer': ('octavia', 'load-balancer', 'v2.0'),
+}
+
+# default size of the cloud
+DEFAULT_SIZES = {
+    'projects': 100,
+    'hypervisors': 50,
+    'aggregates': 5,
+    'volumes': 1000,
+    'floating_ips': 500,
+    'routers': 100,
+    'networks': 100,
+    'agents': 20,
+    'lbs': 100,
+    'listeners_per_lb': 1,
+    'pools_per_lb': 1,
+    'members_per_pool': 3,
+}
+
+VOLUME_STATUSES = ['available'] * 6 + ['in-use'] * 12 + ['creating', 'error']
+
+
+def resource_id(kind, index):
+    """
+    deterministic uuid for the index-th resource of a kind
+    """
+    return "{:08x}-0000-4000-8000-{:012x}".format(kind, index)
+
+
+def resource_index(uuid):
+    """
+    inverse of resource_id
+    """
+    return int(uuid[-12:], 16)
+
+
+class FakeCloud():
+    """
+    The synthetic cloud. Every resource kind is a count and a function building the resource with
+    a given index.
+    """
+    # pylint: disable=fixme, too-many-instance-attributes
+    def __init__(
+            self,
+            sizes=None,
+            latency=0.0,
+            page_size=1000
+        ):
+        self.sizes = dict(DEFAULT_SIZES)
+        self.sizes.update(sizes or {})
+        self.latency = latency
+        self.page_size = page_size
+        self.started = time.time()
+        self.base_url = None
+        self.server = None
+        # (service type, method, route) -> number of requests
+        self.request_counts = {}
+        self.response_bytes = 0
+        self.lock = threading.Lock()
+        sizes = self.sizes
+        self.sizes['listeners'] = sizes['lbs'] * sizes['listeners_per_lb']
+        self.sizes['pools'] = sizes['lbs'] * sizes['pools_per_lb']
+        self.sizes['members'] = sizes['pools'] * sizes['members_per_pool']
+        self.sizes['amphorae'] = sizes['lbs'] * 2
+
+        # route regex -> (resources key, count, builder) for list calls
+        self.lists = {
+            'identity': [
+                (r'/services', 'services', lambda: len(SERVICES), self.service),
+                (r'/projects', 'projects', lambda: sizes['projects'], self.project),
+            ],
+            'compute': [
+                (r'/os-services', 'services', lambda: sizes['hypervisors'] + 2,
+                 self.compute_service),
+                (r'/os-aggregates', 'aggregates', lambda: sizes['aggregates'], self.aggregate),
+                (r'/os-hypervisors/detail', 'hypervisors', lambda: sizes['hypervisors'],
+                 self.hypervisor),
+            ],
+            'block-storage': [
+                (r'/os-services', 'services', lambda: 3, self.volume_service),
+                (r'/volumes/detail', 'volumes', lambda: sizes['volumes'], self.volume),
+            ],
+            'network': [
+                (r'/agents', 'agents', lambda: sizes['agents'], self.agent),
+                (r'/floatingips', 'floatingips', lambda: sizes['floating_ips'], self.floating_ip),
+                (r'/routers', 'routers', lambda: sizes['routers'], self.router),
+                (r'/network-ip-availabilities', 'network_ip_availabilities',
+                 lambda: sizes['networks'], self.network_ip_availability),
+            ],
+            'load-balancer': [
+                (r'/lbaas/loadbalancers', 'loadbalancers', lambda: sizes['lbs'], self.lb),
+                (r'/lbaas/listeners', 'listeners', lambda: sizes['listeners'], self.listener),
+                (r'/lbaas/pools', 'pools', lambda: sizes['pools'], self.pool),
+                (r'/lbaas/healthmonitors', 'healthmonitors', lambda: sizes['pools'],
+                 self.health_monitor),
+                (r'/octavia/amphorae', 'amphorae', lambda: sizes['amphorae'], self.amphora),
+            ],
+        }
+
+    ###################
+    # resource builders
+
+    def service(self, index):
+        """keystone catalog service"""
+        service_type = list(SERVICES)[index]
+        return {'id': resource_id(1, index), 'type': service_type,
+                'name': SERVICES[service_type][0], 'enabled': True}
+
+    def project(self, index):
+        """keystone project"""
+        return {'id': resource_id(2, index), 'name': 'project-{}'.format(index),
+                'domain_id': 'default', 'enabled': True}
+
+    def project_id(self, index):
+        """id of the project owning the index-th resource"""
+        return resource_id(2, index % self.sizes['projects'])
+
+    def compute_service(self, index):
+        """nova micro service"""
+        if index < 2:
+            return {'id': index, 'binary': ['nova-scheduler', 'nova-conductor'][index],
+                    'host': 'controller', 'zone': 'internal', 'status': 'enabled',
+                    'state': 'up'}
+        return {'id': index, 'binary': 'nova-compute', 'host': 'compute{}'.format(index - 2),
+                'zone': 'nova', 'status': 'enabled', 'state': 'up'}
+
+    def aggregate(self, index):
+        """nova host aggregate"""
+        hosts = ['compute{}'.format(host) for host in range(self.sizes['hypervisors'])
+                 if host % self.sizes['aggregates'] == index]
+        return {'id': index, 'name': 'aggregate-{}'.format(index), 'hosts': hosts,
+                'deleted': False, 'availability_zone': 'nova', 'metadata': {}}
+
+    def hypervisor(self, index):
+        """nova hypervisor"""
+        return {
+            'id': resource_id(3, index), 'hypervisor_hostname': 'compute{}.example.com'.format(index),
+            'host_ip': '10.0.0.{}'.format(index % 250), 'state': 'up', 'status': 'enabled',
+            'hypervisor_type': 'QEMU', 'hypervisor_version': 4002000,
+            'cpu_info': json.dumps({'arch': 'x86_64', 'model': 'EPYC', 'vendor': 'AMD',
+                                    'topology': {'cores': 32, 'threads': 2, 'sockets': 2}}),
+            'vcpus': 128, 'vcpus_used': index % 128, 'running_vms': index % 40,
+            'memory_mb': 524288, 'memory_mb_used': 1024 * (index % 512),
+            'free_ram_mb': 524288 - 1024 * (index % 512),
+            'local_gb': 1000, 'local_gb_used': index % 1000, 'free_disk_gb': 1000 - index % 1000,
+            'disk_available_least': 900, 'current_workload': 0,
+            'service': {'host': 'compute{}'.format(index), 'id': index},
+        }
+
+    def volume_service(self, index):
+        """cinder micro service"""
+        binary = ['cinder-scheduler', 'cinder-volume', 'cinder-backup'][index]
+        return {'binary': binary, 'host': 'controller', 'zone': 'nova', 'status': 'enabled',
+                'state': 'up'}
+
+    def volume_updated_at(self, index):
+        """volumes were updated one after the other before the cloud was started"""
+        return time.strftime('%Y-%m-%dT%H:%M:%S.000000', time.gmtime(self.started - index))
+
+    def volume(self, index):
+        """cinder volume"""
+        return {
+            'id': resource_id(4, index), 'name': 'volume-{}'.format(index),
+            'status': VOLUME_STATUSES[index % len(VOLUME_STATUSES)], 'size': 10,
+            'os-vol-tenant-attr:tenant_id': self.project_id(index),
+            'created_at': self.volume_updated_at(index), 'updated_at': self.volume_updated_at(index),
+            'volume_type': 'standard', 'bootable': 'false', 'encrypted': False,
+            'availability_zone': 'nova', 'attachments': [], 'metadata': {},
+        }
+
+    def agent(self, index):
+        """neutron agent"""
+        return {'id': resource_id(5, index), 'binary': 'neutron-openvswitch-agent',
+                'host': 'network{}'.format(index), 'admin_state_up': True, 'alive': True,
+                'agent_type': 'Open vSwitch agent'}
+
+    def floating_ip(self, index):
+        """neutron floating ip"""
+        return {'id': resource_id(6, index), 'project_id': self.project_id(index),
+                'tenant_id': self.project_id(index),
+                'status': ['ACTIVE', 'ACTIVE', 'DOWN'][index % 3],
+                'floating_ip_address': '192.0.{}.{}'.format(index // 250 % 250, index % 250),
+                'floating_network_id': resource_id(7, 0), 'port_id': None,
+                'fixed_ip_address': None, 'router_id': None, 'description': '', 'tags': []}
+
+    def router(self, index):
+        """neutron router"""
+        return {'id': resource_id(8, index), 'name': 'router-{}'.format(index),
+                'project_id': self.project_id(index), 'status': 'ACTIVE',
+                'admin_state_up': True, 'external_gateway_info': None, 'routes': []}
+
+    def network_ip_availability(self, index):
+        """neutron ip availability of a network with two subnets"""
+        subnets = [{
+            'subnet_id': resource_id(17, index * 2 + subnet),
+            'subnet_name': 'subnet-{}-{}'.format(index, subnet),
+            'cidr': '10.{}.{}.0/24'.format(index // 250 % 250, index % 250) if subnet == 0 else
+                    'fd00:{:x}::/64'.format(index),
+            'ip_version': 4 if subnet == 0 else 6,
+            'total_ips': 253 if subnet == 0 else 2 ** 64 - 2,
+            'used_ips': 3 + index % 200,
+        } for subnet in range(2)]
+        return {'network_id': resource_id(18, index), 'network_name': 'network-{}'.format(index),
+                'project_id': self.project_id(index), 'tenant_id': self.project_id(index),
+                'subnet_ip_availability': subnets,
+                'total_ips': sum(subnet['total_ips'] for subnet in subnets),
+                'used_ips': sum(subnet['used_ips'] for subnet in subnets)}
+
+    def lb(self, index):
+        """octavia load balancer"""
+        return {
+            'id': resource_id(9, index), 'name': 'lb-{}'.format(index),
+            'project_id': self.project_id(index), 'operating_status': 'ONLINE',
+            'provisioning_status': 'ACTIVE', 'admin_state_up': True,
+            'vip_address': '10.1.{}.{}'.format(index // 250 % 250, index % 250),
+            'vip_port_id': resource_id(10, index), 'provider': 'amphora',
+        }
+
+    def lb_stats(self, index):
+        """octavia load balancer statistics, increasing with the time"""
+        uptime = int(time.time() - self.started)
+        return {'active_connections': index % 10, 'bytes_in': 1000 * uptime + index,
+                'bytes_out': 5000 * uptime + index, 'total_connections': uptime + index,
+                'request_errors': 0}
+
+    def listener(self, index):
+        """octavia listener"""
+        lb_index = index // self.sizes['listeners_per_lb']
+        return {
+            'id': resource_id(11, index), 'name': 'listener-{}'.format(index),
+            'project_id': self.project_id(lb_index), 'protocol': 'HTTP', 'protocol_port': 80,
+            'loadbalancers': [{'id': resource_id(9, lb_index)}], 'connection_limit': -1,
+            'operating_status': 'ONLINE', 'provisioning_status': 'ACTIVE', 'admin_state_up': True,
+        }
+
+    def pool(self, index):
+        """octavia pool"""
+        lb_index = index // self.sizes['pools_per_lb']
+        listeners = []
+        if self.sizes['listeners_per_lb']:
+            listeners.append({'id': resource_id(
+                11, lb_index * self.sizes['listeners_per_lb'])})
+        return {
+            'id': resource_id(12, index), 'name': 'pool-{}'.format(index),
+            'project_id': self.project_id(lb_index), 'protocol': 'HTTP',
+            'lb_algorithm': 'ROUND_ROBIN', 'loadbalancers': [{'id': resource_id(9, lb_index)}],
+            'listeners': listeners, 'members': [], 'healthmonitor_id': resource_id(13, index),
+            'operating_status': 'ONLINE', 'provisioning_status': 'ACTIVE', 'admin_state_up': True,
+        }
+
+    def member(self, pool_index, index):
+        """octavia member"""
+        member_index = pool_index * self.sizes['members_per_pool'] + index
+        return {
+            'id': resource_id(14, member_index), 'name': 'member-{}'.format(member_index),
+            'project_id': self.project_id(pool_index // self.sizes['pools_per_lb']),
+            'address': '10.2.{}.{}'.format(member_index // 250 % 250, member_index % 250),
+            'protocol_port': 80, 'weight': 1, 'operating_status': 'ONLINE',
+            'provisioning_status': 'ACTIVE', 'admin_state_up': True,
+        }
+
+    def health_monitor(self, index):
+        """octavia health monitor, one per pool"""
+        return {
+            'id': resource_id(13, index), 'name': 'hm-{}'.format(index),
+            'project_id': self.project_id(index // self.sizes['pools_per_lb']),
+            'type': 'HTTP', 'delay': 5, 'timeout': 3, 'max_retries': 3,
+            'pools': [{'id': resource_id(12, index)}], 'operating_status': 'ONLINE',
+            'provisioning_status': 'ACTIVE', 'admin_state_up': True,
+        }
+
+    def amphora(self, index):
+        """octavia amphora, two per load balancer"""
+        return {
+            'id': resource_id(15, index), 'loadbalancer_id': resource_id(9, index // 2),
+            'compute_id': resource_id(16, index), 'status': 'ALLOCATED',
+            'role': ['MASTER', 'BACKUP'][index % 2], 'cert_expiration': '2030-01-01T00:00:00',
+        }
+
+    ###################
+    # keystone
+
+    def catalog(self):
+        """service catalog as returned with a token"""
+        catalog = []
+        for index, (service_type, (name, prefix, version)) in enumerate(SERVICES.items()):
+            url = "{}/{}".format(self.base_url, prefix)
+            if service_type in ('identity', 'compute', 'block-storage'):
+                url += '/' + version
+            catalog.append({
+                'id': resource_id(1, index), 'type': service_type, 'name': name,
+                'endpoints': [{'id': resource_id(17, index * 3 + number), 'interface': interface,
+                               'region': REGION, 'region_id': REGION, 'url': url}
+                              for number, interface in enumerate(['public', 'internal', 'admin'])],
+            })
+        return catalog
+
+    def token(self):
+        """token response body"""
+        now = time.time()
+        return {'token': {
+            'methods': ['password'],
+            'issued_at': time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime(now)),
+            'expires_at': time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime(now + 3600)),
+            'user': {'id': 'admin', 'name': 'admin',
+                     'domain': {'id': 'default', 'name': 'Default'}},
+            'project': {'id': resource_id(2, 0), 'name': 'admin',
+                        'domain': {'id': 'default', 'name': 'Default'}},
+            'roles': [{'id': 'admin', 'name': 'admin'}],
+            'catalog': self.catalog(),
+        }}
+
+    ###################
+    # version discovery
+
+    def version(self, service_type):
+        """version document of an api"""
+        _, prefix, version = SERVICES[service_type]
+        document = {
+            'id': version, 'status': 'CURRENT',
+            'links': [{'rel': 'self', 'href': '{}/{}/{}/'.format(self.base_url, prefix, version)}],
+            'version': '', 'min_version': '',
+        }
+        if service_type == 'identity':
+            document['id'] = 'v3.14'
+            document['status'] = 'stable'
+        elif service_type == 'compute':
+            document['version'] = '2.60'
+            document['min_version'] = '2.1'
+        elif service_type == 'block-storage':
+            document['id'] = 'v3.0'
+            document['version'] = '3.60'
+            document['min_version'] = '3.0'
+        elif service_type == 'load-balancer':
+            document['id'] = 'v2.0'
+        return document
+
+    ###################
+    # request handling
+
+    def count(self, service_type, method, route):
+        """count api requests"""
+        key = (service_type, method, route)
+        with self.lock:
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    def reset_counts(self):
+        """reset the request counters, returns the old ones"""
+        with self.lock:
+            counts, self.request_counts = self.request_counts, {}
+            response_bytes, self.response_bytes = self.response_bytes, 0
+        return counts, response_bytes
+
+    def page(self, url, query, key, count, builder):
+        """one page of a list call, paginated with limit and marker"""
+        limit = int(query.get('limit', [self.page_size])[0])
+        start = 0
+        if 'marker' in query:
+            start = resource_index(query['marker'][0]) + 1
+        items = []
+        index = start
+        since = None
+        if 'updated_at' in query and query['updated_at'][0].startswith('gte:'):
+            since = query['updated_at'][0][4:]
+        while index < count and len(items) < limit:
+            item = builder(index)
+            index += 1
+            if since and item['updated_at'][0:19] < since:
+                # volumes are ordered by updated_at, newest first
+                index = count
+                break
+            if 'fields' in query:
+                # column selection, as supported by neutron and octavia
+                item = {name: item[name] for name in query['fields'] if name in item}
+            items.append(item)
+        body = {key: items}
+        if index < count and items and 'id' in items[-1]:
+            next_query = dict(query)
+            next_query.update({'limit': [limit], 'marker': [items[-1]['id']]})
+            body[key + '_links'] = [{'rel': 'next', 'href': '{}?{}'.format(
+                url, urlencode(next_query, doseq=True))}]
+        return body
+
+    def handle_get(self, service_type, path, url, query):
+        """handle a GET on an api, returns a body or None if not found"""
+        for route, key, count, builder in self.lists[service_type]:
+            if re.fullmatch(route, path):
+                self.count(service_type, 'GET', route)
+                return self.page(url, query, key, count(), builder)
+
+        if service_type == 'block-storage':
+            match = re.fullmatch(r'/volumes/([0-9a-f-]+)', path)
+            if match:
+                self.count(service_type, 'GET', '/volumes/{id}')
+                index = resource_index(match.group(1))
+                if index >= self.sizes['volumes']:
+                    return None
+                return {'volume': self.volume(index)}
+        if service_type == 'load-balancer':
+            match = re.fullmatch(r'/lbaas/loadbalancers/([0-9a-f-]+)/stats', path)
+            if match:
+                self.count(service_type, 'GET', '/lbaas/loadbalancers/{id}/stats')
+                index = resource_index(match.group(1))
+                if index >= self.sizes['lbs']:
+                    return None
+                return {'stats': self.lb_stats(index)}
+            match = re.fullmatch(r'/lbaas/pools/([0-9a-f-]+)/members', path)
+            if match:
+                self.count(service_type, 'GET', '/lbaas/pools/{id}/members')
+                pool_index = resource_index(match.group(1))
+                if pool_index >= self.sizes['pools']:
+                    return None
+                return self.page(url, query, 'members', self.sizes['members_per_pool'],
+                                 lambda index: self.member(pool_index, index))
+        return None
+
+    def handle(self, method, raw_path):
+        """handle a request, returns status, headers and body"""
+        if self.latency and not raw_path.startswith('/_stats'):
+            time.sleep(self.latency)
+        split = urlsplit(raw_path)
+        query = parse_qs(split.query)
+        url = self.base_url + split.path
+        if split.path == '/_stats':
+            # request statistics for the benchmark, not an openstack api
+            if 'reset' in query:
+                counts, response_bytes = self.reset_counts()
+            else:
+                counts, response_bytes = dict(self.request_counts), self.response_bytes
+            return 200, {}, {'requests': [list(key) + [value] for key, value in counts.items()],
+                             'response_bytes': response_bytes}
+        parts = split.path.strip('/').split('/', 2)
+        service_type = None
+        for candidate, (_, prefix, _) in SERVICES.items():
+            if parts[0] == prefix:
+                service_type = candidate
+        if not service_type:
+            # e.g. DummyApiVersions2Up
+            return 200, {}, {'versions': []}
+        _, prefix, version = SERVICES[service_type]
+
+        if len(parts) == 1:
+            self.count(service_type, method, '/')
+            if service_type == 'identity':
+                return 300, {}, {'versions': {'values': [self.version(service_type)]}}
+            return 200, {}, {'versions': [self.version(service_type)]}
+        if parts[1] != version:
+            return 404, {}, {'error': 'not found'}
+        path = '/' + (parts[2] if len(parts) > 2 else '')
+        if path == '/':
+            self.count(service_type, method, '/' + version)
+            return 200, {}, {'version': self.version(service_type)}
+
+        if service_type == 'identity' and path == '/auth/tokens' and method == 'POST':
+            self.count(service_type, method, path)
+            return 201, {'X-Subject-Token': TOKEN}, self.token()
+        if method == 'GET':
+            response = self.handle_get(service_type, path, url, query)
+            if response is not None:
+                return 200, {}, response
+        self.count(service_type, method, 'unknown')
+        return 404, {}, {'error': 'not found'}
+
+    ###################
+    # server
+
+    def start(self, port=0, addr='127.0.0.1'):
+        """start serving in background threads, returns the base url"""
+        cloud = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """http handler calling FakeCloud.handle"""
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def respond(self, method):
+                """handle any method"""
+                # the request body (credentials) is not checked
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                status, headers, response = cloud.handle(method, self.path)
+                content = json.dumps(response).encode()
+                with cloud.lock:
+                    cloud.response_bytes += len(content)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            # pylint: disable=fixme, invalid-name, missing-function-docstring
+            def do_GET(self):
+                self.respond('GET')
+
+            def do_POST(self):
+                self.respond('POST')
+
+            # pylint: disable=fixme, redefined-builtin
+            def log_message(self, format, *args):
+                LOGGER.debug(format, *args)
+
+        class Server(ThreadingHTTPServer):
+            """threaded server"""
+            daemon_threads = True
+            request_queue_size = 128
+
+        self.server = Server((addr, port), Handler)
+        host = addr
+        if addr == '0.0.0.0':
+            host = 'localhost'
+        self.base_url = 'http://{}:{}'.format(host, self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def environment(self):
+        """OS_* environment variables to connect to this cloud"""
+        return {
+            'OS_AUTH_URL': '{}/identity/v3'.format(self.base_url),
+            'OS_AUTH_TYPE': 'password',
+            'OS_IDENTITY_API_VERSION': '3',
+            'OS_USERNAME': 'admin',
+            'OS_PASSWORD': 'secret',
+            'OS_PROJECT_NAME': 'admin',
+            'OS_REGION_NAME': REGION,
+            'OS_USER_DOMAIN_NAME': 'Default',
+            'OS_PROJECT_DOMAIN_NAME': 'Default',
+        }
+
+
+def parse_sizes(args):
+    """size arguments -> dict"""
+    return {name: getattr(args, name) for name in DEFAULT_SIZES}
+
+
+def add_size_arguments(parser):
+    """add the cloud size arguments to an argparse parser"""
+    for name, default in DEFAULT_SIZES.items():
+        parser.add_argument('--' + name.replace('_', '-'), dest=name, type=int, default=default,
+                            help='number of {} (default: {})'.format(
+                                name.replace('_', ' '), default))
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='latency added to every request (default: 0)')
+    parser.add_argument('--page-size', type=int, default=1000,
+                        help='maximum number of resources per page (default: 1000)')
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__)
+    PARSER.add_argument('--port', type=int, default=5000)
+    add_size_arguments(PARSER)
+    ARGS = PARSER.parse_args()
+    logging.basicConfig(level="INFO", format="%(asctime)s:%(levelname)s:%(message)s")
+
+    CLOUD = FakeCloud(parse_sizes(ARGS), ARGS.latency_ms / 1000, ARGS.page_size)
+    CLOUD.start(ARGS.port, '0.0.0.0')
+    for NAME, VALUE in CLOUD.environment().items():
+        print("export {}={}".format(NAME, VALUE))
+    while True:
+        time.sleep(3600)
@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+
+"""
+Benchmark of the openstack-exporter against the fake cloud. Starts fake_cloud.py in a separate
+process, runs a number of collection cycles and reports per cycle: the time per collector, the
+API requests and response bytes per API, the scrape latency and the peak RSS of the exporter.
+
+Exporter settings are taken from the environment (OS_EXPORTER_*) as usual, or given with
+--set OS_EXPORTER_COLLECTOR_WORKERS=4 etc.
+"""
+
+import argparse
+import gzip
+import importlib.util
+import json
+import logging
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXPORTER_DIR = os.path.join(os.path.dirname(HERE), 'openstack-exporter')
+sys.path.insert(0, HERE)
+sys.path.insert(0, EXPORTER_DIR)
+
+# pylint: disable=fixme, wrong-import-position
+from fake_cloud import FakeCloud, add_size_arguments
+
+LOGGER = logging.getLogger(__name__)
+
+
+def free_port():
+    """a tcp port nobody listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def load_exporter():
+    """import openstack-exporter.py, which can not be imported by name"""
+    spec = importlib.util.spec_from_file_location(
+        'openstack_exporter', os.path.join(EXPORTER_DIR, 'openstack-exporter.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def start_fake_cloud(args, port):
+    """run the fake cloud in its own process so it does not compete with the exporter"""
+    command = [sys.executable, os.path.join(HERE, 'fake_cloud.py'), '--port', str(port)]
+    for name, value in vars(args).items():
+        if name in ('cycles', 'scrapes', 'set', 'json', 'port'):
+            continue
+        command += ['--' + name.replace('_', '-'), str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen('http://localhost:{}/_stats'.format(port)).read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("fake cloud did not start")
+
+
+def cloud_stats(port, reset=True):
+    """request counts and response bytes of the fake cloud since the last reset"""
+    url = 'http://localhost:{}/_stats'.format(port)
+    if reset:
+        url += '?reset=1'
+    stats = json.loads(urllib.request.urlopen(url).read())
+    requests = {}
+    for service_type, _, _, count in stats['requests']:
+        requests[service_type] = requests.get(service_type, 0) + count
+    return requests, stats['response_bytes']
+
+
+def scrape(port, count):
+    """scrape the exporter, returns the latencies and the uncompressed size"""
+    latencies = []
+    size = 0
+    for _ in range(count):
+        request = urllib.request.Request('http://localhost:{}/metrics'.format(port),
+                                         headers={'Accept-Encoding': 'gzip'})
+        start = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            body = response.read()
+            if response.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+        latencies.append(time.perf_counter() - start)
+        size = len(body)
+    return sorted(latencies), size
+
+
+def peak_rss_mb():
+    """peak resident memory of this process"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def collection_durations(collector):
+    """total time spent per collector so far"""
+    durations = {}
+    for api_name in collector.collectors:
+        durations[api_name] = collector.registry.get_sample_value(
+            collector.name_prefix + 'collection_duration_seconds_sum', {'api': api_name}) or 0
+    return durations
+
+
+# pylint: disable=fixme, too-many-locals
+def run(args):
+    """run the benchmark, returns the results"""
+    cloud_port = free_port()
+    cloud = FakeCloud()
+    cloud.base_url = 'http://localhost:{}'.format(cloud_port)
+    os.environ.update(cloud.environment())
+    for setting in args.set:
+        name, value = setting.split('=', 1)
+        os.environ[name] = value
+    metrics_port = free_port()
+    os.environ['OS_EXPORTER_LISTEN_PORT'] = str(metrics_port)
+
+    process = start_fake_cloud(args, cloud_port)
+    try:
+        exporter = load_exporter()
+        config = exporter.get_config()
+        exposition_cache = exporter.start_metrics_server(config)
+
+        start = time.perf_counter()
+        collector = exporter.Collector(config)
+        if exposition_cache:
+            collector.refresh_callbacks.append(exposition_cache.invalidate)
+        results = {'startup_seconds': time.perf_counter() - start,
+                   'startup_requests': cloud_stats(cloud_port)[0], 'cycles': []}
+
+        for _ in range(args.cycles):
+            before = collection_durations(collector)
+            start = time.perf_counter()
+            collector.refresh()
+            cycle_seconds = time.perf_counter() - start
+            after = collection_durations(collector)
+            requests, response_bytes = cloud_stats(cloud_port)
+            latencies, size = scrape(metrics_port, args.scrapes)
+            results['cycles'].append({
+                'cycle_seconds': cycle_seconds,
+                'collector_seconds': {api: after[api] - before[api] for api in after},
+                'requests': requests,
+                'response_bytes': response_bytes,
+                'scrape_seconds_median': latencies[len(latencies) // 2],
+                'scrape_seconds_max': latencies[-1],
+                'scrape_bytes': size,
+                'peak_rss_mb': peak_rss_mb(),
+            })
+        return results
+    finally:
+        process.kill()
+
+
+def report(results):
+    """print the results as text"""
+    print("startup: {:.2f}s, {} requests".format(
+        results['startup_seconds'], sum(results['startup_requests'].values())))
+    for number, cycle in enumerate(results['cycles']):
+        print("\ncycle {}: {:.2f}s, {} requests, {:.1f} MB received, peak RSS {:.0f} MB".format(
+            number + 1, cycle['cycle_seconds'], sum(cycle['requests'].values()),
+            cycle['response_bytes'] / 1e6, cycle['peak_rss_mb']))
+        print("  scrape: median {:.3f}s, max {:.3f}s, {:.1f} MB".format(
+            cycle['scrape_seconds_median'], cycle['scrape_seconds_max'],
+            cycle['scrape_bytes'] / 1e6))
+        print("  {:<16} {:>10} {:>10}".format('api', 'seconds', 'requests'))
+        for api_name, seconds in sorted(cycle['collector_seconds'].items()):
+            print("  {:<16} {:>10.3f} {:>10}".format(
+                api_name, seconds, cycle['requests'].get(api_name, 0)))
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--cycles', type=int, default=3, help='collection cycles (default: 3)')
+    PARSER.add_argument('--scrapes', type=int, default=5,
+                        help='scrapes after each cycle (default: 5)')
+    PARSER.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='exporter environment variable, may be given multiple times')
+    PARSER.add_argument('--json', action='store_true', help='print the results as json')
+    add_size_arguments(PARSER)
+    ARGS = PARSER.parse_args()
+    logging.basicConfig(level=os.getenv('OS_EXPORTER_LOG_LEVEL', 'WARNING'),
+                        format="%(asctime)s:%(levelname)s:%(message)s")
+
+    RESULTS = run(ARGS)
+    if ARGS.json:
+        print(json.dumps(RESULTS, indent=2))
+    else:
+        report(RESULTS)
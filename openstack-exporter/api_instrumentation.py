@@ -0,0 +1,199 @@
+"""
+Self instrumentation of the openstack API requests the exporter makes
+"""
+import logging
+import re
+import time
+from urllib.parse import urlsplit
+from keystoneauth1.session import TCPKeepAliveAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from request_scheduler import BACKOFF_STATUS_CODES, retry_after_seconds
+
+LOGGER = logging.getLogger(__name__)
+
+# path segments that are resource ids: uuids, hex ids (e.g. keystone) or numbers (e.g. nova)
+ID_PATTERN = re.compile(r'^([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
+                        r'|[0-9a-fA-F]{32}|[0-9]+)$')
+# last path segments of GET requests that do not return a (page of a) listing
+NON_LISTING_PATTERN = re.compile(r'^(|\{id\}|v[0-9.]+|stats|tokens)$')
+
+
+def endpoint_template(path):
+    """
+    path of a request with the resource ids replaced, e.g. /v2.0/lbaas/loadbalancers/{id}/stats
+    """
+    segments = []
+    for segment in path.split('/'):
+        if ID_PATTERN.match(segment):
+            segment = '{id}'
+        segments.append(segment)
+    return '/'.join(segments) or '/'
+
+
+class EndpointResolver():
+    """
+    maps request urls to the api (service type) and endpoint template, using the urls of the
+    service catalog
+    """
+    def __init__(
+            self,
+            openstack
+        ):
+        self.openstack = openstack
+        # (url prefix, service type), longest prefix first
+        self.prefixes = None
+
+    def _load_prefixes(self):
+        auth = self.openstack.session.auth
+        # only use the catalog we already have, getting one would mean sending a request
+        if not getattr(auth, 'auth_ref', None):
+            return [(auth.auth_url.rstrip('/'), 'identity')]
+        prefixes = {}
+        for service in auth.auth_ref.service_catalog.catalog:
+            service_type = self.openstack.config.get_service_type(service['type'])
+            for endpoint in service.get('endpoints', []):
+                # also match the unversioned parents, e.g. for version discovery requests
+                url = endpoint['url'].rstrip('/')
+                while urlsplit(url).path:
+                    prefixes.setdefault(url, service_type)
+                    url = url.rsplit('/', 1)[0]
+                prefixes.setdefault(url, service_type)
+        self.prefixes = sorted(prefixes.items(), key=lambda prefix: -len(prefix[0]))
+        return self.prefixes
+
+    def resolve(self, url):
+        """
+        returns api and endpoint template for a request url
+        """
+        prefixes = self.prefixes or self._load_prefixes()
+        url = url.split('?', 1)[0]
+        for prefix, service_type in prefixes:
+            if url == prefix or url.startswith(prefix + '/'):
+                # the root of an endpoint (version discovery) always ends with a slash
+                path = url[len(prefix):] or '/'
+                # keep the version of versioned catalog urls, e.g. cinder's /v3/{project_id}
+                base_path = urlsplit(prefix).path
+                return service_type, endpoint_template(base_path + path)
+        return 'unknown', endpoint_template(urlsplit(url).path)
+
+
+class PoolInstrumentation():
+    """
+    mixin for urllib3 connection pools (one per endpoint host), counting how often connections
+    are reused and how often new ones are opened (each with a full TLS handshake for https).
+    Connections idle for longer than idle_timeout are closed instead of reused, e.g. so they are
+    not used just when a load balancer in front of the api closes them.
+    """
+    metrics = None
+    idle_timeout = 0
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        host = "{}://{}:{}".format(self.scheme, self.host, self.port)
+        if getattr(conn, 'sock', None) is not None:
+            if self.idle_timeout and time.monotonic() - getattr(conn, 'last_used', 0) > self.idle_timeout:
+                conn.close()
+                self.metrics['http_connections_idle_closed'].labels(host).inc()
+            else:
+                self.metrics['http_connections_reused'].labels(host).inc()
+                return conn
+        # the connection is opened when the request is sent
+        self.metrics['http_connections_opened'].labels(host).inc()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.last_used = time.monotonic()
+            if self.pool is not None and self.pool.full():
+                # more connections in use than the pool keeps, this one is closed
+                self.metrics['http_connections_discarded'].labels(
+                    "{}://{}:{}".format(self.scheme, self.host, self.port)).inc()
+        super()._put_conn(conn)
+
+
+class InstrumentedHTTPAdapter(TCPKeepAliveAdapter):
+    """
+    requests transport adapter (keeping the TCP keep-alive settings of keystoneauth's own adapter)
+    sending every api request through the RequestScheduler and
+    recording it in the exporter self metrics, independent of the openstack sdk stats hooks.
+    Requests answered with 429 or 503 are retried after the scheduler backed off.
+    The keep-alive pools of the endpoints are sized with pool_connections (endpoints kept) and
+    pool_maxsize (connections kept per endpoint).
+    """
+    # pylint: disable=fixme, too-many-arguments
+    def __init__(
+            self,
+            metrics,
+            resolver,
+            scheduler,
+            idle_timeout=0,
+            **kwargs
+        ):
+        self.metrics = metrics
+        self.resolver = resolver
+        self.scheduler = scheduler
+        attributes = {'metrics': metrics, 'idle_timeout': idle_timeout}
+        self.pool_classes = {
+            'http': type('InstrumentedHTTPConnectionPool',
+                         (PoolInstrumentation, HTTPConnectionPool), attributes),
+            'https': type('InstrumentedHTTPSConnectionPool',
+                          (PoolInstrumentation, HTTPSConnectionPool), attributes),
+        }
+        super().__init__(**kwargs)
+
+    # pylint: disable=fixme, arguments-differ
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.pool_classes
+
+    # pylint: disable=fixme, arguments-differ
+    def send(self, request, **kwargs):
+        api, endpoint = self.resolver.resolve(request.url)
+        retries = self.scheduler.request_retries()
+        attempt = 0
+        while True:
+            with self.scheduler.slot(api) as waited:
+                self.metrics['api_request_wait'].labels(api).observe(waited)
+                response = self._send(request, api, endpoint, **kwargs)
+            if response.status_code not in BACKOFF_STATUS_CODES:
+                return response
+            # the api is backed off whether or not this request is retried
+            delay = self.scheduler.backoff(api, attempt, retry_after_seconds(response))
+            if attempt >= retries:
+                return response
+            attempt += 1
+            self.metrics['api_request_retries'].labels(api, str(response.status_code)).inc()
+            LOGGER.info("%s answered %s %s with %s, retrying in %.1fs", api, request.method,
+                        endpoint, response.status_code, delay)
+            response.close()
+
+    def _send(self, request, api, endpoint, **kwargs):
+        self.metrics['api_requests_in_flight'].labels(api).inc()
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+            if not kwargs.get('stream'):
+                # read the body here, so the duration includes the transfer
+                size = len(response.content)
+            else:
+                size = int(response.headers.get('Content-Length') or 0)
+        except Exception:
+            self.metrics['api_request_duration'].labels(api, request.method, endpoint).observe(
+                time.perf_counter() - start)
+            self.metrics['api_requests'].labels(api, request.method, endpoint, 'error').inc()
+            self.metrics['api_request_errors'].labels(api, request.method, endpoint).inc()
+            raise
+        finally:
+            self.metrics['api_requests_in_flight'].labels(api).dec()
+
+        self.metrics['api_request_duration'].labels(api, request.method, endpoint).observe(
+            time.perf_counter() - start)
+        self.metrics['api_requests'].labels(
+            api, request.method, endpoint, str(response.status_code)).inc()
+        self.metrics['api_response_bytes'].labels(api, request.method, endpoint).inc(size)
+        if response.status_code >= 400:
+            self.metrics['api_request_errors'].labels(api, request.method, endpoint).inc()
+        elif request.method == 'GET' and not NON_LISTING_PATTERN.match(endpoint.rsplit('/', 1)[-1]):
+            # a GET on a collection -> one page of a listing
+            self.metrics['api_list_pages'].labels(api, endpoint).inc()
+        return response
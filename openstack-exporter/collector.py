@@ -2,33 +2,93 @@
 Openstack Collector. Discover and init openstack API collectors
 """
 
+import importlib
 import logging
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
 import openstack
-from prometheus_client import Enum, Gauge, Info, Summary
+from prometheus_client import (REGISTRY, CollectorRegistry, Counter, Enum, Gauge, Histogram, Info,
+                               Summary)
+from api_instrumentation import EndpointResolver, InstrumentedHTTPAdapter
 from collector_api_base import CollectorAPIBase
-from collector_api_compute import CollectorAPICompute
-from collector_api_network import CollectorAPINetwork
-from collector_api_block_storage import CollectorAPIBlockStorage
-from collector_api_load_balancer import CollectorAPILoadBalancer
+from discovery_cache import DiscoveryCache
+from project_directory import ProjectDirectory
+from request_scheduler import RequestScheduler
+from token_cache import TokenCache
 from resources_dummy import DummyApiVersions1Up
+from snapshot_collector import SnapshotCollector, take_snapshot
 
 LOGGER = logging.getLogger(__name__)
 openstack.enable_logging(debug=False)
 
+# service type -> module and class of its collector. The modules (and the sdk resources they use)
+# are only imported when the service is in the catalog and not excluded.
+COLLECTOR_CLASSES = {
+    'compute': ('collector_api_compute', 'CollectorAPICompute'),
+    'block-storage': ('collector_api_block_storage', 'CollectorAPIBlockStorage'),
+    'network': ('collector_api_network', 'CollectorAPINetwork'),
+    'load-balancer': ('collector_api_load_balancer', 'CollectorAPILoadBalancer'),
+}
+# other services only get their api state checked, these ones with the v1 version document
+API_VERSIONS_1_UP_SERVICES = ('image', 'cloudformation')
+
 class Collector():
     """
-    A collection of all openstack api collectors.
+    A collection of all openstack api collectors of one cloud and region.
+
+    The cloud (from clouds.yaml) and region default to the OS_* environment variables. To collect
+    several clouds or regions, every one gets its own Collector, all publishing to the same
+    snapshots. Their metrics are then labeled with the cloud and region. Snapshots passed in are
+    not registered, their owner serves them.
     """
+    # pylint: disable=fixme, too-many-instance-attributes
     def __init__(
             self,
-            config
+            config,
+            cloud=None,
+            region=None,
+            snapshots=None
         ):
         self.config = config
+        self.cloud = cloud
+        self.region = region
+        self.started = time.monotonic()
         self.name_prefix = config['metric_prefix'] + "_"
+        # labels added to all metrics when collecting several clouds or regions, set once
+        # connected
+        self.labels = {} if config['clouds'] else None
+        if snapshots:
+            self.registry = CollectorRegistry()
+            self.snapshots = snapshots
+        elif config['snapshot_mode']:
+            # metrics are served from snapshots of complete collection runs only
+            self.registry = CollectorRegistry()
+            self.snapshots = SnapshotCollector()
+            REGISTRY.register(self.snapshots)
+        else:
+            self.registry = REGISTRY
+            self.snapshots = None
         self.init_metrics()
         self.init_openstack()
         self.init_collectors()
+        # bounded pool the collectors run on. With a single worker the APIs are polled one
+        # after the other, which keeps the load on the cloud as low as possible.
+        self.executor = ThreadPoolExecutor(max_workers=config['collector_workers'],
+                                           thread_name_prefix="collector")
+        # api_name -> future of the last submitted run of that collector
+        self.runs = {}
+        self.runs_lock = threading.Lock()
+        # functions called after each collector run, e.g. to invalidate the rendered metrics
+        self.refresh_callbacks = []
+        # api_name -> monotonic time the last run of that collector completed
+        self.collected = {}
+        # collectors that did not complete their first run yet
+        self.first_runs_pending = set(self.collectors)
+        if self.discovery_cache.loaded:
+            # the collectors were built from cached discovery data, check it in the background
+            threading.Thread(target=self.rediscover, name="rediscover", daemon=True).start()
 
     def init_metrics(self):
         """
@@ -37,89 +97,288 @@ class Collector():
         self.metrics = {}
 
         self.metrics['api_state'] = Enum(
-            self.name_prefix + 'api_state', 'Status of API', ['api'], states=['up', 'down'])
+            self.name_prefix + 'api_state', 'Status of API', ['api'], states=['up', 'down'],
+            registry=self.registry)
 
         self.metrics['api_info'] = Info(
-            self.name_prefix + 'api', 'Version information about APIs', labelnames=['api'])
+            self.name_prefix + 'api', 'Version information about APIs', labelnames=['api'],
+            registry=self.registry)
 
         self.metrics['service_state'] = Enum(
             self.name_prefix + 'service_state', 'Status of micro-service',
-            ['api', 'micro_service', 'host'], states=['up', 'down'])
+            ['api', 'micro_service', 'host'], states=['up', 'down'], registry=self.registry)
         self.metrics['service_status'] = Enum(
             self.name_prefix + 'service_status', 'Status of micro-service',
-            ['api', 'micro_service', 'host'], states=['enabled', 'disabled'])
+            ['api', 'micro_service', 'host'], states=['enabled', 'disabled'],
+            registry=self.registry)
 
         self.metrics['collection_duration'] = Summary(
             self.name_prefix + 'collection_duration_seconds',
-            'Time spend collecting all data', ['api'])
+            'Time spend collecting all data', ['api'], registry=self.registry)
 
         self.metrics['collection_timestamp'] = Gauge(
             self.name_prefix + 'collection_timestamp',
-            'Timestamp of last successfull collection run')
+            'Timestamp of last successfull collection run', registry=self.registry)
+
+        self.metrics['state_items'] = Gauge(
+            self.name_prefix + 'exporter_state_items',
+            'Resources (label sets) a collector keeps track of', ['api', 'state'],
+            registry=self.registry)
+        self.metrics['state_bytes'] = Gauge(
+            self.name_prefix + 'exporter_state_bytes',
+            'Approximate memory used by the state a collector keeps between runs', ['api'],
+            registry=self.registry)
+
+        self.metrics['startup_duration'] = Gauge(
+            self.name_prefix + 'exporter_startup_duration_seconds',
+            'Time from the start of the exporter until all collectors completed their first run',
+            registry=self.registry)
+
+        self.metrics['phase_duration'] = Summary(
+            self.name_prefix + 'collection_phase_duration_seconds',
+            'Time spend in a phase of a collection run', ['api', 'phase'], registry=self.registry)
+
+        self.metrics['project_lookup_misses'] = Counter(
+            self.name_prefix + 'exporter_project_lookup_misses',
+            'Project name lookups of project ids unknown to keystone, e.g. of deleted projects',
+            registry=self.registry)
+
+        # self instrumentation of the openstack api requests the exporter makes
+        self.metrics['api_requests'] = Counter(
+            self.name_prefix + 'exporter_api_requests', 'API requests made by the exporter',
+            ['api', 'method', 'endpoint', 'status'], registry=self.registry)
+        self.metrics['api_request_errors'] = Counter(
+            self.name_prefix + 'exporter_api_request_errors',
+            'API requests made by the exporter that failed', ['api', 'method', 'endpoint'],
+            registry=self.registry)
+        self.metrics['api_request_duration'] = Histogram(
+            self.name_prefix + 'exporter_api_request_duration_seconds',
+            'Duration of the API requests made by the exporter', ['api', 'method', 'endpoint'],
+            buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60), registry=self.registry)
+        self.metrics['api_response_bytes'] = Counter(
+            self.name_prefix + 'exporter_api_response_bytes',
+            'Size of the API responses received by the exporter', ['api', 'method', 'endpoint'],
+            registry=self.registry)
+        self.metrics['api_list_pages'] = Counter(
+            self.name_prefix + 'exporter_api_list_pages', 'Pages of API listings fetched',
+            ['api', 'endpoint'], registry=self.registry)
+        self.metrics['api_requests_in_flight'] = Gauge(
+            self.name_prefix + 'exporter_api_requests_in_flight',
+            'API requests of the exporter waiting for a response', ['api'], registry=self.registry)
+        self.metrics['api_request_wait'] = Summary(
+            self.name_prefix + 'exporter_api_request_wait_seconds',
+            'Time API requests waited for the request scheduler', ['api'], registry=self.registry)
+        self.metrics['api_request_retries'] = Counter(
+            self.name_prefix + 'exporter_api_request_retries',
+            'API requests retried after the API asked to back off', ['api', 'status'],
+            registry=self.registry)
+        self.metrics['http_connections_opened'] = Counter(
+            self.name_prefix + 'exporter_http_connections_opened',
+            'Connections opened to API endpoints, with a TLS handshake for https', ['host'],
+            registry=self.registry)
+        self.metrics['http_connections_reused'] = Counter(
+            self.name_prefix + 'exporter_http_connections_reused',
+            'Requests sent on a kept alive connection', ['host'], registry=self.registry)
+        self.metrics['http_connections_idle_closed'] = Counter(
+            self.name_prefix + 'exporter_http_connections_idle_closed',
+            'Kept alive connections closed after the idle timeout', ['host'],
+            registry=self.registry)
+        self.metrics['http_connections_discarded'] = Counter(
+            self.name_prefix + 'exporter_http_connections_discarded',
+            'Connections closed because the connection pool was full', ['host'],
+            registry=self.registry)
 
     def init_openstack(self):
         """
         init connection to openstack
         """
         # open connection
-        self.openstack = openstack.connect(app_name="openstack-exporter", app_version="0.1")
+        self.openstack = openstack.connect(cloud=self.cloud, region_name=self.region,
+                                           app_name="openstack-exporter", app_version="0.1")
+        if self.labels is not None:
+            self.labels['cloud'] = self.cloud or ''
+            self.labels['region'] = self.openstack.config.region_name or ''
+        self.init_api_instrumentation()
+
+        # reuse the token of an earlier start, if cached, otherwise authenticate now
+        self.token_cache = TokenCache(self.openstack, self.config['token_cache_dir'],
+                                      self.config['token_refresh_margin'])
+        if not self.token_cache.load():
+            self.token_cache.refresh()
+
+        self.project_directory = ProjectDirectory(self.openstack, self.config['project_cache_ttl'],
+                                                  self.metrics['project_lookup_misses'])
 
-        # when adding services (proxy) by string instead of class, then openstack sdk uses some
-        # generic service-description and proxy all the necessary info is taken from the catalog
-        self.openstack.add_service("cloudformation")
+        self.discovery_cache = DiscoveryCache(self.openstack, self.config['discovery_cache_dir'],
+                                              self.config['discovery_cache_ttl'])
+        self.discovery_cache.load()
 
+    def init_api_instrumentation(self):
+        """
+        send all requests of the openstack connection through the request scheduler and record
+        them in the exporter self metrics
+        """
+        self.endpoint_resolver = EndpointResolver(self.openstack)
+        self.request_scheduler = RequestScheduler(
+            self.config['max_in_flight'], self.config['api_max_in_flight'],
+            self.config['max_requests_per_second'], self.config['request_retries'],
+            self.config['max_backoff'])
+        adapter = InstrumentedHTTPAdapter(
+            self.metrics, self.endpoint_resolver, self.request_scheduler,
+            idle_timeout=self.config['http_idle_timeout'],
+            pool_connections=self.config['http_pool_connections'],
+            pool_maxsize=self.config['http_pool_maxsize'])
+        for prefix in ('https://', 'http://'):
+            self.openstack.session.session.mount(prefix, adapter)
 
     def init_collectors(self):
         """
         discover available endpoints and initialize collectors for them if they are not
-        excluded in the config
+        excluded in the config. Stores the discovered data for the next start.
         """
         self.collectors = {}
-        for service in self.openstack.list_services():
-            if not service.name in self.config['api-exclude']:
-                # normalize service_type name
-                service_type = self.openstack.config.get_service_type(service['service_type'])
+        for service_name, service_type in self.discovery_cache.get_services():
+            if not service_name in self.config['api-exclude']:
                 if not service_type in self.collectors:
-                    if service_type == 'compute':
-                        self.collectors[service_type] = CollectorAPICompute(
-                            self.config, self.openstack, self.metrics, service_type, service.name,
-                            self.name_prefix)
-                    elif service_type == 'block-storage':
-                        self.collectors[service_type] = CollectorAPIBlockStorage(
-                            self.config, self.openstack, self.metrics, service_type, service.name,
-                            self.name_prefix)
-                    elif service_type == 'image':
-                        self.collectors[service_type] = CollectorAPIBase(
-                            self.config, self.openstack, self.metrics, service_type, service.name,
-                            self.name_prefix, [DummyApiVersions1Up])
-                    elif service_type == 'network':
-                        self.collectors[service_type] = CollectorAPINetwork(
-                            self.config, self.openstack, self.metrics, service_type, service.name,
-                            self.name_prefix)
-                    elif service_type == 'load-balancer':
-                        self.collectors[service_type] = CollectorAPILoadBalancer(
-                            self.config, self.openstack, self.metrics, service_type, service.name,
-                            self.name_prefix)
-                    elif service_type == 'cloudformation':
-                        self.collectors[service_type] = CollectorAPIBase(
-                            self.config, self.openstack, self.metrics, service_type, service.name,
-                            self.name_prefix, [DummyApiVersions1Up])
-                    else:
-                        self.collectors[service_type] = CollectorAPIBase(
-                            self.config, self.openstack, self.metrics, service_type, service.name,
-                            self.name_prefix)
+                    self.collectors[service_type] = self.create_collector(service_type, service_name)
+        if not self.discovery_cache.loaded:
+            self.discovery_cache.save()
 
-    def refresh(self):
+    def create_collector(self, service_type, service_name):
+        """
+        create the collector of a service, importing its module on first use
+        """
+        if service_type in COLLECTOR_CLASSES:
+            module_name, class_name = COLLECTOR_CLASSES[service_type]
+            collector_class = getattr(importlib.import_module(module_name), class_name)
+            return collector_class(
+                self.config, self.openstack, self.metrics, service_type, service_name,
+                self.name_prefix, project_directory=self.project_directory,
+                discovery_cache=self.discovery_cache)
+        if service_type == 'cloudformation':
+            # when adding services (proxy) by string instead of class, then openstack sdk uses some
+            # generic service-description and proxy all the necessary info is taken from the catalog
+            self.openstack.add_service("cloudformation")
+        if service_type in API_VERSIONS_1_UP_SERVICES:
+            return CollectorAPIBase(
+                self.config, self.openstack, self.metrics, service_type, service_name,
+                self.name_prefix, [DummyApiVersions1Up], project_directory=self.project_directory,
+                discovery_cache=self.discovery_cache)
+        return CollectorAPIBase(
+            self.config, self.openstack, self.metrics, service_type, service_name,
+            self.name_prefix, project_directory=self.project_directory,
+            discovery_cache=self.discovery_cache)
+
+    def rediscover(self):
+        """
+        discover the services and api versions again and update the discovery cache
+        """
+        try:
+            services = self.discovery_cache.discover_services()
+            for api_name, collector in self.collectors.items():
+                self.discovery_cache.discover_versions(api_name)
+                collector.get_api_version()
+            self.discovery_cache.save()
+            # excluded services are not new, like in init_collectors()
+            new_services = {service_type for service_name, service_type in services
+                            if not service_name in self.config['api-exclude']}
+            new_services -= set(self.collectors)
+            if new_services:
+                LOGGER.info("New services {} are collected after a restart.".format(new_services))
+        # pylint: disable=fixme, broad-except
+        except Exception:
+            LOGGER.error("Rediscovery of the services failed.")
+            LOGGER.error(traceback.format_exc())
+
+    def get_interval(self, api_name):
         """
-        refresh cached metrics
+        how often (in seconds) the collector of the given api should run
         """
-        for api_name, collector in self.collectors.items():
-            with self.metrics['collection_duration'].labels(api_name).time():
-                try:
-                    collector.collect()
-                # pylint: disable=fixme, bare-except
-                except:
-                    LOGGER.error("Unhandled exception during data collection in the {} collector.".format(api_name))
-                    LOGGER.error(traceback.format_exc())
+        return self.config['api_intervals'].get(api_name, self.config['interval'])
+
+    def refresh_collector(self, api_name, collector):
+        """
+        run a single collector, errors are logged but do not affect the other collectors
+        """
+        try:
+            # renew the token now, rather than have it expire in the middle of the run
+            self.token_cache.refresh()
+        # pylint: disable=fixme, broad-except
+        except Exception:
+            LOGGER.error("Could not renew the keystone token.")
+            LOGGER.error(traceback.format_exc())
+
+        with self.metrics['collection_duration'].labels(api_name).time():
+            try:
+                collector.collect()
+            # pylint: disable=fixme, bare-except
+            except:
+                LOGGER.error("Unhandled exception during data collection in the {} collector.".format(api_name))
+                LOGGER.error(traceback.format_exc())
+        with collector.phase('state size'):
+            collector.update_state_metrics()
 
         self.metrics['collection_timestamp'].set_to_current_time()
+        self.collected[api_name] = time.monotonic()
+        with self.runs_lock:
+            if self.first_runs_pending:
+                self.first_runs_pending.discard(api_name)
+                if not self.first_runs_pending:
+                    self.metrics['startup_duration'].set(time.monotonic() - self.started)
+        if self.snapshots:
+            self.publish_snapshot(api_name, collector)
+        for callback in self.refresh_callbacks:
+            callback()
+        LOGGER.debug("Collection done for {}".format(api_name))
+
+    def publish_snapshot(self, api_name, collector):
+        """
+        publish the metrics of a collector, together with its samples of the shared metrics
+        """
+        families = take_snapshot(collector.registry, labels=self.labels)
+        families.extend(take_snapshot(
+            self.registry, lambda sample: sample.labels.get('api') == api_name, self.labels))
+        self.snapshots.publish((self.cloud, self.region, api_name), families)
+        # shared metrics not belonging to a single collector, e.g. collection_timestamp or the
+        # requests to the identity api
+        self.snapshots.publish((self.cloud, self.region, None), take_snapshot(
+            self.registry, lambda sample: sample.labels.get('api') not in self.collectors,
+            self.labels))
+
+    def submit(self, api_name):
+        """
+        schedule a run of the collector for the given api on the worker pool. If the collector
+        is still queued or running from an earlier submit, no new run is scheduled and the
+        future of the pending run is returned instead.
+        """
+        with self.runs_lock:
+            future = self.runs.get(api_name)
+            if future and not future.done():
+                LOGGER.info("Collection for {} is still in progress, not scheduling another one.".
+                            format(api_name))
+                return future
+            future = self.executor.submit(self.refresh_collector, api_name,
+                                          self.collectors[api_name])
+            self.runs[api_name] = future
+        # nobody else looks at the futures of timer driven runs, errors outside of the
+        # collector (e.g. in the snapshot or a refresh callback) would be lost silently
+        future.add_done_callback(lambda done: self.log_run_error(api_name, done))
+        return future
+
+    @staticmethod
+    def log_run_error(api_name, future):
+        """
+        log the exception a collector run ended with, if any
+        """
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        LOGGER.error("Unhandled exception after data collection in the {} collector.".format(api_name))
+        LOGGER.error("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+
+    def refresh(self):
+        """
+        refresh cached metrics of all collectors. The collectors are run on the worker pool, the
+        refresh is done when the slowest of them is done.
+        """
+        wait([self.submit(api_name) for api_name in self.collectors])
@@ -2,10 +2,168 @@
 Base Class for Openstack API collectors
 """
 import logging
+import sys
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import REGISTRY, CollectorRegistry
+from discovery_cache import fetch_version_data
+from request_scheduler import without_retries
 from resources_dummy import DummyApiVersions, DummyApiVersions1Up, DummyApiVersions2Up
 
 LOGGER = logging.getLogger(__name__)
+# measuring the memory used by the state walks all of it, so it is only done every few minutes
+STATE_SIZE_INTERVAL = 600
+
+def state_size(state):
+    """
+    approximate memory used by collector state: containers, their contents and the objects
+    in them (not followed further), each object counted once
+    """
+    seen = set()
+    size = 0
+    pending = [state]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+    return size
+
+class LabelSets():
+    """
+    Tracks the label value sets of a group of metrics that describe the same kind of resource
+    (e.g. all lb_* metrics of the load balancers). The metric children are cached between
+    collections, and label sets that were not seen in a collection are removed from all metrics
+    of the group in one go.
+
+    Label values are interned: every distinct value (e.g. a project id used by thousands of
+    volumes) is kept once, no matter how often it is decoded from the api responses.
+    """
+    def __init__(
+            self,
+            metrics,
+            metric_names
+        ):
+        self.metrics = metrics
+        self.metric_names = list(metric_names)
+        self.positions = {name: position for position, name in enumerate(self.metric_names)}
+        # label sets seen since the last reconcile()
+        self.current = set()
+        # label set exported right now -> metric children, by position in metric_names
+        self.children = {}
+        # label value -> the one instance of it that is kept
+        self.strings = {}
+        # label sets removed since the strings were last cleaned up
+        self.removed = 0
+        # label counts of the metrics, and label values of metrics with fewer labels than the
+        # label sets -> how many exported label sets start with them
+        self.lengths = sorted({len(metrics[name]._labelnames) for name in self.metric_names})
+        self.prefixes = {}
+
+    @property
+    def known(self):
+        """
+        label sets exported right now
+        """
+        return self.children.keys()
+
+    def intern(self, item):
+        """
+        the label set with its values replaced by the kept instances
+        """
+        strings = self.strings
+        return tuple(strings.setdefault(value, value) if isinstance(value, str) else value
+                     for value in item)
+
+    def child(self, metric_name, item):
+        """
+        get the child of a metric for the label values of item and mark item as seen. Metrics with
+        fewer labels than item (e.g. info metrics only labeled by id) use the first label values.
+        """
+        children = self.children.get(item)
+        if children is None:
+            item = self.intern(item)
+            children = self.children[item] = [None] * len(self.metric_names)
+            self._count_prefixes(item, 1)
+        self.current.add(item)
+        position = self.positions[metric_name]
+        child = children[position]
+        if child is None:
+            metric = self.metrics[metric_name]
+            child = metric.labels(*item[0:len(metric._labelnames)])
+            children[position] = child
+        return child
+
+    def seen(self, item):
+        """
+        mark item as seen without touching its metrics, e.g. because its values did not change
+        """
+        self.current.add(item)
+
+    def _count_prefixes(self, item, count):
+        for length in self.lengths:
+            if length >= len(item):
+                break
+            prefix = item[0:length]
+            self.prefixes[prefix] = self.prefixes.get(prefix, 0) + count
+            if not self.prefixes[prefix]:
+                del self.prefixes[prefix]
+
+    def begin(self):
+        """
+        start a new collection, only needed when not every collection ends with reconcile()
+        """
+        self.current = set()
+
+    def remove(self, items):
+        """
+        remove the metrics of the given label sets
+        """
+        items = set(items)
+        if not items:
+            return
+        for item in items:
+            if self.children.pop(item, None) is not None:
+                self._count_prefixes(item, -1)
+        for metric_name in self.metric_names:
+            metric = self.metrics[metric_name]
+            length = len(metric._labelnames)
+            for item in items:
+                labels = item[0:length]
+                if length < len(item) and labels in self.prefixes:
+                    # still used by a label set that stays (e.g. the same id with a new name)
+                    continue
+                try:
+                    metric.remove(*labels)
+                # pylint: disable=fixme, broad-except
+                except Exception as exc:
+                    LOGGER.debug("Error removing metric: %s(%s): %s", metric_name, str(item), str(exc))
+        self.current -= items
+        self.removed += len(items)
+        if self.removed > len(self.children) // 10:
+            # forget the values only used by removed label sets
+            self.strings = {}
+            self.children = {self.intern(item): children for item, children in self.children.items()}
+            self.prefixes = {self.intern(prefix): count for prefix, count in self.prefixes.items()}
+            self.removed = 0
+
+    def reconcile(self):
+        """
+        remove all label sets not seen since the last reconcile(). Returns the removed label sets.
+        """
+        stale = self.known - self.current
+        for item in stale:
+            LOGGER.debug("Removing: {}".format(item))
+        self.remove(stale)
+        self.current = set()
+        return stale
 
 # pylint: disable=fixme, too-many-instance-attributes
 class CollectorAPIBase():
@@ -22,7 +180,9 @@ class CollectorAPIBase():
             api_name,
             project_name,
             name_prefix,
-            api_check_resources = (DummyApiVersions, DummyApiVersions1Up, DummyApiVersions2Up)
+            api_check_resources = (DummyApiVersions, DummyApiVersions1Up, DummyApiVersions2Up),
+            project_directory = None,
+            discovery_cache = None
         ):
         self.config = config
         self.openstack = openstack
@@ -32,9 +192,27 @@ class CollectorAPIBase():
         self.initialized = False
         self.name_prefix = name_prefix + api_name.replace("-", '_') + "_"
         self.api_check_resources = api_check_resources
-        self.seen_microservices = {}
+        # ProjectDirectory to resolve project ids to names
+        self.project_directory = project_directory
+        # DiscoveryCache with the version data of the apis
+        self.discovery_cache = discovery_cache
+        # name -> LabelSets
+        self.label_sets = {}
+        self.track_labels('services', ['service_state', 'service_status'])
+        # when the memory used by the state was last measured
+        self.state_size_updated = None
+        # in snapshot mode every collector has its own registry, that is published as a whole
+        # after each collection run
+        if config['snapshot_mode']:
+            self.registry = CollectorRegistry()
+        else:
+            self.registry = REGISTRY
         self.state_is_up = False
         self.init()
+        # with discovery data from the cache, the proxy (and its version discovery) is only
+        # created by the first collection run, so startup does not wait for it
+        if not (discovery_cache and discovery_cache.loaded):
+            self.init_proxy()
 
 
     def init_metrics(self):
@@ -42,46 +220,74 @@ class CollectorAPIBase():
         init collector specific prometheus metrics
         """
 
+    def track_labels(self, name, metric_names):
+        """
+        create the LabelSets tracking the label sets of the given metrics
+        """
+        self.label_sets[name] = LabelSets(self.metrics, metric_names)
+        return self.label_sets[name]
+
+    def phase(self, name):
+        """
+        context manager timing a phase of the collection, e.g. `with self.phase('members'):`
+        """
+        return self.metrics['phase_duration'].labels(self.api_name, name).time()
+
+    def update_state_metrics(self):
+        """
+        export how many label sets the collector keeps and how much memory its state takes
+        """
+        for name, label_sets in self.label_sets.items():
+            self.metrics['state_items'].labels(self.api_name, name).set(len(label_sets.children))
+        if (self.state_size_updated is not None and
+                time.monotonic() - self.state_size_updated < STATE_SIZE_INTERVAL):
+            return
+        self.state_size_updated = time.monotonic()
+        state = [{name: (label_sets.children, label_sets.strings)
+                  for name, label_sets in self.label_sets.items()}, getattr(self, 'data', None)]
+        self.metrics['state_bytes'].labels(self.api_name).set(state_size(state))
+
     def get_api_version(self):
         """
         get API Versions, this works even when api is down
         """
         try:
             LOGGER.debug("Get API version for: {}({})".format(self.api_name, self.project_name))
-            for version in self.openstack.config.get_all_version_data(self.api_name):
-                if version.status == "CURRENT":
-                    self.metrics['api_info'].labels(self.api_name).info({
-                        'status': str(version.status),
-                        'version': str(version.version),
-                        'min_microversion': str(version.min_microversion),
-                        'max_microversion': str(version.max_microversion)
-                        })
-                    LOGGER.debug(version)
+            if self.discovery_cache:
+                versions = self.discovery_cache.get_versions(self.api_name)
+            else:
+                versions = fetch_version_data(self.openstack, self.api_name)
+            for version in versions:
+                if version['status'] == "CURRENT":
+                    self.metrics['api_info'].labels(self.api_name).info(version)
         # pylint: disable=fixme, broad-except
         except Exception:
             LOGGER.error(traceback.format_exc())
 
     def init(self):
         """
-        init part that can be overridden
+        init part that can be overridden, runs once
         """
         self.init_metrics()
         self.get_api_version()
 
-        # force instatiation of proxy
-        if not self.api_name in self.openstack._proxies:
-            try:
-                eval("self.openstack." + self.api_name.replace("-", '_'))
-                LOGGER.info("Instantiated proxy for: {}({})".format(self.api_name, self.project_name))
-                self.initialized = True
+    def init_proxy(self):
+        """
+        instantiate the proxy of the api, retried on every collection run until it succeeds
+        """
+        try:
+            # force instatiation of proxy (or use the one created already, e.g. for identity)
+            getattr(self.openstack, self.api_name.replace("-", '_'))
+            LOGGER.info("Instantiated proxy for: {}({})".format(self.api_name, self.project_name))
+            self.initialized = True
 
-                self._prometheus_counter = self.openstack._proxies[self.api_name]._prometheus_counter
-                self._prometheus_histogram = self.openstack._proxies[self.api_name]._prometheus_histogram
-            # pylint: disable=fixme, broad-except
-            except Exception:
-                # no need to do anything, this will be retried on next run
-                LOGGER.info("Could not initialize proxy for {}({})".
-                            format(self.api_name, self.project_name))
+            self._prometheus_counter = self.openstack._proxies[self.api_name]._prometheus_counter
+            self._prometheus_histogram = self.openstack._proxies[self.api_name]._prometheus_histogram
+        # pylint: disable=fixme, broad-except
+        except Exception:
+            # no need to do anything, this will be retried on next run
+            LOGGER.info("Could not initialize proxy for {}({})".
+                        format(self.api_name, self.project_name))
 
 
     def get_api_state(self):
@@ -95,7 +301,8 @@ class CollectorAPIBase():
             LOGGER.debug("Check API status for {}".format(self.api_name))
             for resource in self.api_check_resources:
                 try:
-                    self.openstack._proxies[self.api_name]._get(resource, requires_id=False)
+                    with without_retries():
+                        self.openstack._proxies[self.api_name]._get(resource, requires_id=False)
                     state = "up"
                     self.state_is_up = True
                 # pylint: disable=fixme, bare-except
@@ -106,24 +313,18 @@ class CollectorAPIBase():
         self.metrics['api_state'].labels(self.api_name).state(state)
 
     def _update_micro_service_metrics(self, services):
-        current = {}
+        label_sets = self.label_sets['services']
         for service in services:
             item = (self.api_name, service['binary'], service['host'])
-            current[item] = 1
             LOGGER.debug(service)
             LOGGER.debug("Checking Microservices status for: {} - {} {} {} {}".
                          format(self.api_name, service['binary'], service['host'],
                                 service['status'], service['state']))
-            self.metrics['service_state'].labels(*list(item)).state(service['state'])
-            self.metrics['service_status'].labels(*list(item)).state(service['status'])
+            label_sets.child('service_state', item).state(service['state'])
+            label_sets.child('service_status', item).state(service['status'])
 
         # remove microservices that are gone
-        for item in self.seen_microservices:
-            if not item in current:
-                LOGGER.debug("Deleting micro service: {}-{}-{}".format(*list(item)))
-                self.savely_remove_labels('service_state', item)
-                self.savely_remove_labels('service_status', item)
-        self.seen_microservices = current
+        label_sets.reconcile()
 
 
     def collect_micro_service_state(self):
@@ -142,25 +343,34 @@ class CollectorAPIBase():
         get current value of all metrics
         """
         if not self.initialized:
-            self.init()
-        self.get_api_state()
+            self.get_api_version()
+            self.init_proxy()
+        with self.phase('api state'):
+            self.get_api_state()
         if  self.state_is_up:
-            self.collect_micro_service_state()
+            with self.phase('micro services'):
+                self.collect_micro_service_state()
             self.collect_api_specific_data()
 
-    def savely_remove_labels(self, metric, label_values):
+    # pylint: disable=fixme, no-self-use
+    def fetch_concurrently(self, func, keys, workers, ignored_exceptions=(Exception,)):
         """
-        for some metrics, it is important to remove label value sets that are not longer present
-        in the cloud. The prometheus library does not do this automatically for counter no longer 
-        being updated.
+        call func(key) for every key, using up to `workers` threads. Returns a dict with the
+        result per key. When func raises one of the ignored_exceptions (e.g. the resource
+        disappeared in the meantime) the result for that key is None.
         """
-        try:
-            labels = list(label_values)
-            labels = labels[0:len(self.metrics[metric]._labelnames)]
-            self.metrics[metric].remove(*labels)
-        # pylint: disable=fixme, broad-except
-        except Exception as exc:
-            LOGGER.debug("Error removing metric: %s(%s): %s", metric, str(label_values), str(exc))
+        def call(key):
+            try:
+                return func(key)
+            except ignored_exceptions as exc:
+                LOGGER.debug("Ignoring error while fetching %s: %s", key, str(exc))
+                return None
+
+        keys = list(keys)
+        if workers <= 1 or len(keys) <= 1:
+            return {key: call(key) for key in keys}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(keys, executor.map(call, keys)))
 
     def disable_stats_collection(self, api_name=None):
         """
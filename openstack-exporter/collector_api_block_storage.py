@@ -3,14 +3,47 @@ Volume / Cinder collector
 """
 import datetime
 import logging
+import time
+import traceback
 from prometheus_client import Gauge, Enum
+from openstack.exceptions import ResourceNotFound
 from collector_api_base import CollectorAPIBase
 from resources_block_storage import Service
 from resources_dummy import DummyApiVersions1Up
-from resources_volumes import Volume
+from resources_volumes import ChangedVolume, Volume
 
 LOGGER = logging.getLogger(__name__)
-VOLUMES_WRONG_STATE_WAIT_TIME = datetime.timedelta(minutes=5)
+# incremental listings start this long before the newest updated_at seen, so that volumes
+# updated in transactions still running during the last listing are not missed
+VOLUMES_CHANGES_OVERLAP = datetime.timedelta(minutes=1)
+# filtering the volume listing by updated_at with an operator needs this microversion
+VOLUMES_CHANGES_MICROVERSION = (3, 60)
+VOLUME_STATUSES = [
+        'CREATING', 'AVAILABLE', 'RESERVED', 'ATTACHING', 'DETACHING', 'IN-USE',
+        'MAINTENANCE', 'DELETING', 'AWAITING-TRANSFER', 'ERROR', 'ERROR_DELETING', 'BACKING-UP',
+        'RESTORING-BACKUP', 'ERROR_BACKING-UP', 'ERROR_RESTORING', 'ERROR_EXTENDING',
+        'DOWNLOADING', 'UPLOADING', 'RETYPING', 'EXTENDING'
+]
+# volumes in these states get no volume_status series of their own, unless all volumes are
+# exported (volumes_detail 'all'). All other states are errors or transitional states.
+STEADY_VOLUME_STATUSES = ('AVAILABLE', 'IN-USE')
+
+
+def is_transitional(status):
+    """
+    whether volumes should leave the status by themselves (e.g. creating, detaching)
+    """
+    return status not in STEADY_VOLUME_STATUSES and not status.startswith('ERROR')
+
+
+def parse_updated_at(updated_at):
+    """
+    updated_at of a volume (UTC) as timestamp, now if it is missing
+    """
+    if not updated_at:
+        return time.time()
+    return datetime.datetime.fromisoformat(updated_at.rstrip('Z')).replace(
+        tzinfo=datetime.timezone.utc).timestamp()
 
 class CollectorAPIBlockStorage(CollectorAPIBase):
     """
@@ -24,25 +57,47 @@ class CollectorAPIBlockStorage(CollectorAPIBase):
             metrics,
             api_name,
             project_name,
-            name_prefix
+            name_prefix,
+            project_directory=None,
+            discovery_cache=None
         ):
         self.data = {}
+        self.statuses = {status: status for status in VOLUME_STATUSES}
         super().__init__(config, openstack, metrics, api_name, project_name, name_prefix,
-                         [DummyApiVersions1Up])
+                         [DummyApiVersions1Up],
+                         project_directory=project_directory,
+                         discovery_cache=discovery_cache)
 
     def init_metrics(self):
-        operating_statuses = [
-                'CREATING', 'AVAILABLE', 'RESERVED', 'ATTACHING', 'DETACHING', 'IN-USE', 
-                'MAINTENANCE', 'DELETING', 'AWAITING-TRANSFER', 'ERROR', 'ERROR_DELETING', 'BACKING-UP', 
-                'RESTORING-BACKUP', 'ERROR_BACKING-UP', 'ERROR_RESTORING', 'ERROR_EXTENDING', 
-                'DOWNLOADING', 'UPLOADING', 'RETYPING', 'EXTENDING'
-        ]
+        # volume id -> label values
         self.data['volumes'] = {}
+        # volume id -> status
+        self.data['volume_statuses'] = {}
+        # (project id, status) -> number of volumes
+        self.data['volume_counts'] = {}
+        # volume id -> since when the volume is in its transitional status
+        self.data['volumes_transitional_since'] = {}
+        # newest updated_at seen, start point for the next incremental listing
+        self.data['volumes_updated_at'] = None
+        self.data['volumes_full_sync'] = None
+        # whether cinder supports listing the changed volumes, checked on first use
+        self.data['volumes_changes_supported'] = None
         self.metrics['volumes'] = Gauge(
-            self.name_prefix + 'volumes', '', ['status'])
+            self.name_prefix + 'volumes', '', ['status'], registry=self.registry)
+        self.metrics['project_volumes'] = Gauge(
+            self.name_prefix + 'project_volumes', '', ['project_id', 'status'],
+            registry=self.registry)
+        self.track_labels('project_volumes', ['project_volumes'])
         volume_labels = ['id', 'name', 'project_id']
         self.metrics['volume_status'] = Enum(
-            self.name_prefix + 'volume_status', '', volume_labels, states=operating_statuses)
+            self.name_prefix + 'volume_status', '', volume_labels, states=VOLUME_STATUSES,
+            registry=self.registry)
+        self.track_labels('volumes', ['volume_status'])
+        self.metrics['volume_stuck_seconds'] = Gauge(
+            self.name_prefix + 'volume_stuck_seconds',
+            'how long volumes stuck in a transitional status are in it already',
+            volume_labels + ['status'], registry=self.registry)
+        self.track_labels('stuck_volumes', ['volume_stuck_seconds'])
 
     def collect_micro_service_state(self):
         services = []
@@ -51,17 +106,186 @@ class CollectorAPIBlockStorage(CollectorAPIBase):
                              'status': service.status, 'state': service.state})
         self._update_micro_service_metrics(services)
 
-    def collect_api_specific_data(self):
-        # volumes
-        current = {}
+    def _count_volume(self, project_id, status, count):
+        counts = self.data['volume_counts']
+        key = (project_id, status)
+        counts[key] = counts.get(key, 0) + count
+        if not counts[key]:
+            del counts[key]
+
+    def _update_volume(self, volume):
+        label_sets = self.label_sets['volumes']
+        item = (volume.id, volume.name, volume.project_id)
+        # one instance per status for all volumes
+        status = self.statuses.get(volume.status.upper(), volume.status.upper())
+        old_item = self.data['volumes'].get(volume.id)
+        old_status = self.data['volume_statuses'].get(volume.id)
+        if old_item != item:
+            if old_item in label_sets.children:
+                # e.g. renamed volume
+                label_sets.remove([old_item])
+            item = label_sets.intern(item)
+            self.data['volumes'][item[0]] = item
+        if old_item is None or old_item[2] != item[2] or old_status != status:
+            if old_item is not None:
+                self._count_volume(old_item[2], old_status, -1)
+            self._count_volume(item[2], status, 1)
+            self.data['volume_statuses'][item[0]] = status
+        if old_status != status:
+            if is_transitional(status):
+                self.data['volumes_transitional_since'][item[0]] = parse_updated_at(
+                    volume.updated_at)
+            else:
+                self.data['volumes_transitional_since'].pop(item[0], None)
+        detail = self.config['block_storage']['volumes_detail']
+        if detail == 'all' or (detail == 'problems' and status not in STEADY_VOLUME_STATUSES):
+            label_sets.child('volume_status', item).state(status)
+        elif item in label_sets.children:
+            # the volume is back in a steady state
+            label_sets.remove([item])
+
+    @staticmethod
+    def _newest(updated_at, volume):
+        if volume.updated_at and (not updated_at or volume.updated_at > updated_at):
+            return volume.updated_at
+        return updated_at
+
+    def _supports_changed_volumes(self):
+        """
+        whether cinder can list the volumes changed since a given time. Older cinder versions
+        ignore the updated_at filter instead of failing, the microversion has to be checked.
+        """
+        if self.data['volumes_changes_supported'] is None:
+            endpoint_data = self.openstack.block_storage.get_endpoint_data()
+            max_microversion = endpoint_data.max_microversion if endpoint_data else None
+            self.data['volumes_changes_supported'] = bool(
+                max_microversion and max_microversion >= VOLUMES_CHANGES_MICROVERSION)
+            if not self.data['volumes_changes_supported']:
+                LOGGER.warning("Cinder does not support microversion 3.60 (max {}), listing all "
+                               "volumes on every collection.".format(max_microversion))
+        return self.data['volumes_changes_supported']
+
+    def _forget_volume(self, volume_id):
+        item = self.data['volumes'].pop(volume_id)
+        self._count_volume(item[2], self.data['volume_statuses'].pop(volume_id), -1)
+        self.data['volumes_transitional_since'].pop(volume_id, None)
+        return item
+
+    def _collect_all_volumes(self):
+        """
+        list all volumes, returns their ids
+        """
+        current = set()
+        updated_at = None
+        self.label_sets['volumes'].begin()
         for volume in self.openstack.block_storage._list(Volume, base_path="/volumes/detail", all_projects=True):
-            item = (volume.id, volume.name, volume.project_id)
-            current[item] = 1
-            self.metrics['volume_status'].labels(*list(item)).state(volume.status.upper())
-
-        # Remove volumes which are no longer present
-        for item in self.data['volumes']:
-            if item not in current:
-                LOGGER.debug("Removing non-existing volume: {}".format(item))
-                self.savely_remove_labels('volume_status', item)
-        self.data['volumes'] = current
+            current.add(volume.id)
+            self._update_volume(volume)
+            updated_at = self._newest(updated_at, volume)
+
+        # Remove volumes which are no longer present
+        self.label_sets['volumes'].reconcile()
+        for volume_id in list(self.data['volumes']):
+            if volume_id not in current:
+                self._forget_volume(volume_id)
+        # only a complete listing moves the start of the next incremental listing
+        self.data['volumes_updated_at'] = updated_at
+        self.data['volumes_full_sync'] = time.monotonic()
+        return current
+
+    def _collect_changed_volumes(self):
+        """
+        list the volumes changed since the last listing, returns their ids
+        """
+        since = datetime.datetime.fromisoformat(self.data['volumes_updated_at'].rstrip('Z'))
+        since = (since - VOLUMES_CHANGES_OVERLAP).isoformat(timespec='seconds')
+        changed = set()
+        updated_at = self.data['volumes_updated_at']
+        for volume in self.openstack.block_storage._list(
+                ChangedVolume, base_path="/volumes/detail", all_projects=True,
+                updated_at="gte:" + since):
+            changed.add(volume.id)
+            self._update_volume(volume)
+            updated_at = self._newest(updated_at, volume)
+        self.data['volumes_updated_at'] = updated_at
+        LOGGER.debug("{} volumes changed since {}".format(len(changed), since))
+        return changed
+
+    def _update_volume_counts(self):
+        totals = dict.fromkeys(VOLUME_STATUSES, 0)
+        label_sets = self.label_sets['project_volumes']
+        label_sets.begin()
+        for (project_id, status), count in self.data['volume_counts'].items():
+            totals[status] = totals.get(status, 0) + count
+            label_sets.child('project_volumes', (project_id, status)).set(count)
+        label_sets.reconcile()
+        for status, count in totals.items():
+            self.metrics['volumes'].labels(status).set(count)
+
+    def _fetch_volume(self, volume_id):
+        """
+        get a volume not in the last listing and update it. Volumes deleted since they were last
+        listed (e.g. stuck in deleting) are forgotten. Returns whether the volume still exists.
+        """
+        try:
+            volume = self.openstack.block_storage._get(Volume, volume_id)
+        except ResourceNotFound:
+            LOGGER.debug("Volume {} is gone.".format(volume_id))
+            item = self._forget_volume(volume_id)
+            if item in self.label_sets['volumes'].children:
+                self.label_sets['volumes'].remove([item])
+            return False
+        self._update_volume(volume)
+        return True
+
+    def _update_stuck_volumes(self, listed):
+        """
+        export the volumes in a transitional status for too long. Stuck volumes not in the last
+        listing (an incremental listing only has the changed ones, not the deleted ones) are
+        fetched again to confirm them, so this costs one request per stuck volume at most.
+        """
+        # only volumes in transitional states are tracked, so this is cheap
+        stuck_time = self.config['block_storage']['volumes_stuck_time']
+        now = time.time()
+        label_sets = self.label_sets['stuck_volumes']
+        label_sets.begin()
+        transitional_since = self.data['volumes_transitional_since']
+        for volume_id, since in list(transitional_since.items()):
+            if now - since <= stuck_time:
+                continue
+            if volume_id not in listed:
+                try:
+                    if not self._fetch_volume(volume_id) or volume_id not in transitional_since:
+                        continue
+                # pylint: disable=fixme, broad-except
+                except Exception:
+                    # keep reporting it
+                    LOGGER.warning("Could not get the stuck volume {}.".format(volume_id))
+                    LOGGER.debug(traceback.format_exc())
+                since = transitional_since[volume_id]
+                if now - since <= stuck_time:
+                    continue
+            item = self.data['volumes'][volume_id] + (self.data['volume_statuses'][volume_id],)
+            label_sets.child('volume_stuck_seconds', item).set(now - since)
+        label_sets.reconcile()
+
+    def collect_api_specific_data(self):
+        # volumes. Deleted volumes are only noticed by a full listing -> between full listings
+        # only the volumes changed since the last listing are fetched, if configured.
+        full_sync_interval = self.config['block_storage']['volumes_full_sync_interval']
+        with self.phase('volumes'):
+            if (not full_sync_interval or not self.data['volumes_updated_at'] or
+                    time.monotonic() - self.data['volumes_full_sync'] >= full_sync_interval or
+                    not self._supports_changed_volumes()):
+                listed = self._collect_all_volumes()
+            else:
+                try:
+                    listed = self._collect_changed_volumes()
+                # pylint: disable=fixme, broad-except
+                except Exception:
+                    # e.g. the updated_at filter is rejected
+                    LOGGER.warning("Listing changed volumes failed, listing all volumes instead.")
+                    LOGGER.debug(traceback.format_exc())
+                    listed = self._collect_all_volumes()
+            self._update_stuck_volumes(listed)
+            self._update_volume_counts()
@@ -9,6 +9,7 @@ from resources_dummy import DummyApiVersions
 
 
 LOGGER = logging.getLogger(__name__)
+HYPERVISOR_INFO_LABELS = ('name', 'aggregates', 'arch', 'model', 'ip', 'vcpus', 'ram_gb', 'disk_gb')
 
 class CollectorAPICompute(CollectorAPIBase):
     """
@@ -22,7 +23,9 @@ class CollectorAPICompute(CollectorAPIBase):
             metrics,
             api_name,
             project_name,
-            name_prefix
+            name_prefix,
+            project_directory=None,
+            discovery_cache=None
         ):
         self.host_measurements = {
             'vcpus':'vcpus', 'vcpus_used':'vcpus_used',
@@ -34,26 +37,37 @@ class CollectorAPICompute(CollectorAPIBase):
         }
         self.data = {}
         super().__init__(config, openstack, metrics, api_name, project_name, name_prefix,
-                         [DummyApiVersions])
+                         [DummyApiVersions],
+                         project_directory=project_directory,
+                         discovery_cache=discovery_cache)
 
 
     def init_metrics(self):
+        # label set -> values last written to the metrics of a hypervisor / an aggregate
+        self.data['hypervisors'] = {}
+        self.data['aggregates'] = {}
+        # host -> (cpu_info as returned by the api, (arch, model))
+        self.data['cpu_info'] = {}
+        # host -> (aggregate names, aggregates label)
+        self.data['host_aggregates'] = {}
         for measurement in self.host_measurements:
             self.metrics[measurement] = Gauge(
-                self.name_prefix + measurement, '', ['host', 'name', 'aggregates'])
+                self.name_prefix + measurement, '', ['host', 'name', 'aggregates'],
+                registry=self.registry)
 
         self.metrics['hypervisor_state'] = Enum(
             self.name_prefix + 'hypervisor_state', '', ['host', 'name', 'aggregates'],
-            states=['up', 'down'])
+            states=['up', 'down'], registry=self.registry)
         self.metrics['hypervisor_status'] = Enum(
             self.name_prefix + 'hypervisor_status', '', ['host', 'name', 'aggregates'],
-            states=['enabled', 'disabled'])
+            states=['enabled', 'disabled'], registry=self.registry)
         self.metrics['hypervisor_info'] = Info(
-            self.name_prefix + 'hypervisor', '', ['host'])
+            self.name_prefix + 'hypervisor', '', ['host'], registry=self.registry)
         self.metrics['aggregates_info'] = Info(
-            self.name_prefix + 'aggregates', '', ['name'])
-        self.data['aggregates'] = {}
-        self.data['hosts'] = {}
+            self.name_prefix + 'aggregates', '', ['name'], registry=self.registry)
+        self.track_labels('aggregates', ['aggregates_info'])
+        self.track_labels('hosts', list(self.host_measurements) + [
+            'hypervisor_state', 'hypervisor_status', 'hypervisor_info'])
 
 
     def collect_micro_service_state(self):
@@ -64,63 +78,93 @@ class CollectorAPICompute(CollectorAPIBase):
                              'status': service.status, 'state': service.state})
         self._update_micro_service_metrics(services)
 
+    def _cpu_info(self, host, cpu_info):
+        """
+        arch and model of the hypervisor cpu. cpu_info is a json string with older sdk versions,
+        it is only parsed again when it changed.
+        """
+        cached = self.data['cpu_info'].get(host)
+        if cached is not None and cached[0] == cpu_info:
+            return cached[1]
+        parsed = cpu_info if isinstance(cpu_info, dict) else json.loads(cpu_info)
+        result = (str(parsed['arch']), str(parsed['model']))
+        self.data['cpu_info'][host] = (cpu_info, result)
+        return result
+
+    def _aggregates_label(self, host, names):
+        """
+        comma separated aggregates of a host, the same string as long as they do not change
+        """
+        cached = self.data['host_aggregates'].get(host)
+        if cached is not None and cached[0] == names:
+            return cached[1]
+        label = ",".join(names) if names else 'none'
+        self.data['host_aggregates'][host] = (names, label)
+        return label
+
     def collect_api_specific_data(self):
+        # host -> names of its aggregates
         aggregates = {}
-        current = {}
-        for aggregate in self.openstack.compute.aggregates():
-            if not aggregate.deleted: 
-                item = (aggregate.name)
-                current[item] = 1
-                self.metrics['aggregates_info'].labels(aggregate.name).info(
-                    {'id': str(aggregate.id), 'hosts': ",".join(aggregate.hosts)})
-                for hypervisor in aggregate.hosts:
-                    if not hypervisor in aggregates:
-                        aggregates[hypervisor] = aggregate.name
+        label_sets = self.label_sets['aggregates']
+        with self.phase('aggregates'):
+            for aggregate in self.openstack.compute.aggregates():
+                # older sdk versions call it deleted, newer ones is_deleted
+                if not (aggregate.get('deleted') or aggregate.get('is_deleted')):
+                    item = (aggregate.name,)
+                    info = (str(aggregate.id), ",".join(aggregate.hosts))
+                    if self.data['aggregates'].get(item) == info:
+                        label_sets.seen(item)
                     else:
-                        aggregates[hypervisor] = aggregates[hypervisor] + "," + aggregate.name
+                        label_sets.child('aggregates_info', item).info(
+                            {'id': info[0], 'hosts': info[1]})
+                        self.data['aggregates'][item] = info
+                    for hypervisor in aggregate.hosts:
+                        aggregates[hypervisor] = aggregates.get(hypervisor, ()) + (aggregate.name,)
+        for item in label_sets.reconcile():
+            self.data['aggregates'].pop(item, None)
 
-        for item in self.data['aggregates']:
-            if item not in current:
-                self.savely_remove_labels('aggregates_info', item)
-        self.data['aggregates'] = current
-
-        current = {}
-        for hypervisor in self.openstack.compute.hypervisors(details=True):
-            host = hypervisor.name.split('.')[0]
-            if host in aggregates:
-                item=(host, hypervisor.name, aggregates[host])
-            else:
-                item=(host, hypervisor.name, 'none')
-            current[item] = 1
-
-            for measurement, attribute in self.host_measurements.items():
-                if measurement.endswith("_bytes"):
-                    self.metrics[measurement].labels(*list(item)).set(hypervisor[attribute] * 1048576)
-                else:
-                    self.metrics[measurement].labels(*list(item)).set(hypervisor[attribute])
-            cpu_info = hypervisor.cpu_info
-            if not isinstance(cpu_info, dict):
-                cpu_info = json.loads(cpu_info)
-
-            self.metrics['hypervisor_state'].labels(*list(item)).state(hypervisor.state)
-            self.metrics['hypervisor_status'].labels(*list(item)).state(hypervisor.status)
-            self.metrics['hypervisor_info'].labels(host).info({
-                'name': str(hypervisor.name), 
-                'aggregates': str(aggregates[host]), 
-                'arch': str(cpu_info['arch']), 
-                'model': str(cpu_info['model']),
-                'ip': str(hypervisor.host_ip),
-                'vcpus': str(hypervisor.vcpus),
-                'ram_gb': str(hypervisor.memory_size),
-                'disk_gb': str(hypervisor.local_disk_size),
-            })
+        label_sets = self.label_sets['hosts']
+        with self.phase('hypervisors'):
+            for hypervisor in self.openstack.compute.hypervisors(details=True):
+                host = hypervisor.name.split('.')[0]
+                item = (host, hypervisor.name, self._aggregates_label(host, aggregates.get(host)))
+                values = tuple(hypervisor[attribute] for attribute in self.host_measurements.values())
+                arch, model = self._cpu_info(host, hypervisor.cpu_info)
+                info = (str(hypervisor.name), str(item[2]), arch, model, str(hypervisor.host_ip),
+                        str(hypervisor.vcpus), str(hypervisor.memory_size),
+                        str(hypervisor.local_disk_size))
+                # most attributes of a hypervisor rarely change, only changed values are written
+                fields = (values, hypervisor.state, hypervisor.status, info)
+                old = self.data['hypervisors'].get(item)
+                if old == fields:
+                    label_sets.seen(item)
+                    continue
+                if old is None:
+                    old = (None,) * len(values), None, None, None
+                for position, measurement in enumerate(self.host_measurements):
+                    if values[position] == old[0][position]:
+                        continue
+                    if measurement.endswith("_bytes"):
+                        label_sets.child(measurement, item).set(values[position] * 1048576)
+                    else:
+                        label_sets.child(measurement, item).set(values[position])
+                if fields[1] != old[1]:
+                    label_sets.child('hypervisor_state', item).state(hypervisor.state)
+                if fields[2] != old[2]:
+                    label_sets.child('hypervisor_status', item).state(hypervisor.status)
+                if fields[3] != old[3]:
+                    label_sets.child('hypervisor_info', item).info(
+                        dict(zip(HYPERVISOR_INFO_LABELS, info)))
+                self.data['hypervisors'][item] = fields
 
-        # remove host items which are no longer present
-        for item in self.data['hosts']:
-            if item not in current:
-                for measurement in self.host_measurements:
-                    self.savely_remove_labels(measurement, item)
-                self.savely_remove_labels('hypervisor_state', item)
-                self.savely_remove_labels('hypervisor_status', item)
-                self.savely_remove_labels('hypervisor_info', item)
-        self.data['hosts'] = current
+        # remove host items which are no longer present, and the cached values of their hosts
+        removed_hosts = set()
+        for item in label_sets.reconcile():
+            self.data['hypervisors'].pop(item, None)
+            removed_hosts.add(item[0])
+        if removed_hosts:
+            # a host may just have moved to another label set, e.g. a new aggregate
+            removed_hosts -= {item[0] for item in label_sets.known}
+        for host in removed_hosts:
+            self.data['cpu_info'].pop(host, None)
+            self.data['host_aggregates'].pop(host, None)
@@ -3,11 +3,24 @@ Ocatavia Collector
 """
 import logging
 from prometheus_client import Enum, Gauge, Info, Counter
-from openstack.exceptions import ResourceNotFound
+from openstack.exceptions import ResourceNotFound, raise_from_response
+from openstack.load_balancer.v2.load_balancer import LoadBalancerStats
 from collector_api_base import CollectorAPIBase
 from resources_dummy import DummyApiVersions1Up
+from resources_load_balancer import Amphora, HealthMonitor, Listener, LoadBalancer, Member, Pool
 
 LOGGER = logging.getLogger(__name__)
+# only these fields are requested from octavia
+LB_FIELDS = ['id', 'name', 'project_id', 'operating_status', 'admin_state_up',
+             'provisioning_status', 'vip_address', 'vip_port_id']
+LISTENER_FIELDS = ['id', 'name', 'project_id', 'loadbalancers', 'admin_state_up',
+                   'provisioning_status', 'operating_status', 'connection_limit']
+POOL_FIELDS = ['id', 'name', 'project_id', 'loadbalancers', 'listeners', 'admin_state_up',
+               'provisioning_status', 'operating_status']
+MEMBER_FIELDS = ['id', 'name', 'admin_state_up']
+HM_FIELDS = ['id', 'name', 'project_id', 'pools', 'admin_state_up', 'provisioning_status',
+             'operating_status']
+AMPHORA_FIELDS = ['id', 'loadbalancer_id', 'status', 'role']
 
 class CollectorAPILoadBalancer(CollectorAPIBase):
     """
@@ -21,13 +34,16 @@ class CollectorAPILoadBalancer(CollectorAPIBase):
             metrics,
             api_name,
             project_name,
-            name_prefix
+            name_prefix,
+            project_directory=None,
+            discovery_cache=None
         ):
         self.data = {}
         self.lb_gauges = {}
         self.lb_couters = {}
         super().__init__(config, openstack, metrics, api_name, project_name, name_prefix,
-                    [DummyApiVersions1Up])
+                    [DummyApiVersions1Up], project_directory=project_directory,
+                    discovery_cache=discovery_cache)
 
     def _admin_state_to_string(self, state):
         if state:
@@ -35,6 +51,17 @@ class CollectorAPILoadBalancer(CollectorAPIBase):
         return "disabled"
 
 
+    def _get_load_balancer_statistics(self, lb_id):
+        """
+        same as openstack.load_balancer.get_load_balancer_statistics() but with a timeout.
+        Returns the stats as dict.
+        """
+        response = self.openstack.load_balancer.get(
+            LoadBalancerStats.base_path % {'lb_id': lb_id},
+            timeout=self.config['load_balancer']['lb_stats_timeout'])
+        raise_from_response(response)
+        return response.json()[LoadBalancerStats.resource_key]
+
     def init_metrics(self):
 
         # one could argue, that the operating_status, admin_status, and provisioning_status
@@ -49,353 +76,323 @@ class CollectorAPILoadBalancer(CollectorAPIBase):
         admin_statuses = ['enabled', 'disabled']
 
         # load balancers
-        self.data['lbs'] = {}
         self.data['lbs_project_id'] = {}
-        self.metrics['lb_info'] = Info(self.name_prefix + 'lb', '', ['id'])
-        self.data['project_name'] = {}
+        self.metrics['lb_info'] = Info(self.name_prefix + 'lb', '', ['id'], registry=self.registry)
         lb_labels = ['id', 'name', 'project_id']
         self.metrics['lb_operating_status'] = Enum(
-            self.name_prefix + 'lb_operating_status', '', lb_labels, states=operating_statuses)
+            self.name_prefix + 'lb_operating_status', '', lb_labels, states=operating_statuses,
+            registry=self.registry)
         self.metrics['lb_admin_status'] = Enum(
-            self.name_prefix + 'lb_admin_status', '', lb_labels, states=admin_statuses)
+            self.name_prefix + 'lb_admin_status', '', lb_labels, states=admin_statuses,
+            registry=self.registry)
         self.metrics['lb_provisioning_status'] = Enum(
             self.name_prefix + 'lb_provisioning_status', '', lb_labels,
-            states=provisioning_statuses)
+            states=provisioning_statuses, registry=self.registry)
 
+        # lb label set -> last counter values, in the order of lb_couters
+        self.data['lb_counters_current'] = {}
         if self.config['load_balancer']['collect_lb_stats']:
             self.lb_gauges = {
                 'lb_active_connections':'active_connections',
             }
             for measurement in self.lb_gauges:
-                self.metrics[measurement] = Gauge(self.name_prefix + measurement, '', lb_labels)
+                self.metrics[measurement] = Gauge(self.name_prefix + measurement, '', lb_labels,
+                    registry=self.registry)
 
-            self.data['lb_counters_current'] = {}
             self.lb_couters = {
                 'lb_in_bytes':'bytes_in', 'lb_out_bytes':'bytes_out',
                 'lb_connections':'total_connections',
                 'lb_request_errors':'request_errors',
             }
             for measurement in self.lb_couters:
-                self.metrics[measurement] = Counter(self.name_prefix + measurement, '', lb_labels)
-                self.data['lb_counters_current'][measurement] = {}
+                self.metrics[measurement] = Counter(self.name_prefix + measurement, '', lb_labels,
+                    registry=self.registry)
 
         # listenener
-        self.data['listeneners'] = {}
         listener_labels = ['id', 'name', 'project_id', 'loadbalancers']
         self.metrics['listener_provisioning_status'] = Enum(
             self.name_prefix + 'listener_provisioning_status', '', listener_labels,
-            states=provisioning_statuses)
+            states=provisioning_statuses, registry=self.registry)
         self.metrics['listener_operating_status'] = Enum(
             self.name_prefix + 'listener_operating_status', '', listener_labels,
-            states=operating_statuses)
+            states=operating_statuses, registry=self.registry)
         self.metrics['listener_admin_status'] = Enum(
             self.name_prefix + 'listener_admin_status', '', listener_labels,
-            states=admin_statuses)
+            states=admin_statuses, registry=self.registry)
         self.metrics['listener_connection_limit'] = Gauge(
-            self.name_prefix + 'listener_connection_limit', '', listener_labels)
+            self.name_prefix + 'listener_connection_limit', '', listener_labels,
+            registry=self.registry)
 
         # pool
-        self.data['pools'] = {}
         self.data['pools_data'] = {}
         self.data['pools_data']['lbs'] = {}
         self.data['pools_data']['listeners'] = {}
         pool_labels = ['id', 'name', 'project_id', 'loadbalancers', 'listeners']
         self.metrics['pool_admin_status'] = Enum(
-            self.name_prefix + 'pool_admin_status', '', pool_labels, states=admin_statuses)
+            self.name_prefix + 'pool_admin_status', '', pool_labels, states=admin_statuses,
+            registry=self.registry)
         self.metrics['pool_provisioning_status'] = Enum(
             self.name_prefix + 'pool_provisioning_status', '', pool_labels,
-            states=provisioning_statuses)
+            states=provisioning_statuses, registry=self.registry)
         self.metrics['pool_operating_status'] = Enum(
-            self.name_prefix + 'pool_operating_status', '', pool_labels, states=operating_statuses)
+            self.name_prefix + 'pool_operating_status', '', pool_labels, states=operating_statuses,
+            registry=self.registry)
 
         # member
         if self.config['load_balancer']['collect_member_stats']:
-            self.data['members'] = {}
             member_labels = ['id', 'name', 'project_id', 'loadbalancers', 'listeners', 'pool_id']
             self.metrics['member_admin_status'] = Enum(
-                self.name_prefix + 'member_admin_status', '', member_labels, states=admin_statuses)
+                self.name_prefix + 'member_admin_status', '', member_labels, states=admin_statuses,
+                registry=self.registry)
             self.metrics['member_provisioning_status'] = Enum(
                 self.name_prefix + 'member_provisioning_status', '', member_labels,
-                states=provisioning_statuses)
+                states=provisioning_statuses, registry=self.registry)
             self.metrics['member_operating_status'] = Enum(
                 self.name_prefix + 'member_operating_status', '', member_labels,
-                states=operating_statuses)
+                states=operating_statuses, registry=self.registry)
 
         # health monitor
-        self.data['hms'] = {}
         hm_labels = ['id', 'name', 'project_id', 'loadbalancers', 'listeners', 'pools']
         self.metrics['hm_admin_status'] = Enum(
-            self.name_prefix + 'hm_admin_status', '', hm_labels, states=admin_statuses)
+            self.name_prefix + 'hm_admin_status', '', hm_labels, states=admin_statuses,
+            registry=self.registry)
         self.metrics['hm_provisioning_status'] = Enum(
             self.name_prefix + 'hm_provisioning_status', '', hm_labels,
-            states=provisioning_statuses)
+            states=provisioning_statuses, registry=self.registry)
         self.metrics['hm_operating_status'] = Enum(
-            self.name_prefix + 'hm_operating_status', '', hm_labels, states=operating_statuses)
+            self.name_prefix + 'hm_operating_status', '', hm_labels, states=operating_statuses,
+            registry=self.registry)
 
         # amphorae
-        self.data['amphorae'] = {}
         amphora_labels = ['id', 'loadbalancer_id', 'project_id']
         self.metrics['amphora_status'] = Enum(
             self.name_prefix + 'amphora_status', '', amphora_labels,
             states=['BOOTING', 'ALLOCATED', 'READY', 'PENDING_CREATE',
-                    'PENDING_DELETE', 'DELETED', 'ERROR'])
+                    'PENDING_DELETE', 'DELETED', 'ERROR'], registry=self.registry)
         self.metrics['amphora_role'] = Enum(
             self.name_prefix + 'amphora_role', '', amphora_labels,
-            states=['STANDALONE', 'MASTER', 'BACKUP'])
+            states=['STANDALONE', 'MASTER', 'BACKUP'], registry=self.registry)
         self.metrics['amphora_cert_expiration'] = Gauge(
-            self.name_prefix + 'amphora_cert_expiration', '', amphora_labels)
+            self.name_prefix + 'amphora_cert_expiration', '', amphora_labels,
+            registry=self.registry)
+
+        self.track_labels('lbs', ['lb_operating_status', 'lb_admin_status', 'lb_provisioning_status',
+                                  'lb_info'] + list(self.lb_gauges) + list(self.lb_couters))
+        self.track_labels('listeners', ['listener_admin_status', 'listener_provisioning_status',
+                                        'listener_operating_status', 'listener_connection_limit'])
+        self.track_labels('pools', ['pool_admin_status', 'pool_provisioning_status',
+                                    'pool_operating_status'])
+        if self.config['load_balancer']['collect_member_stats']:
+            self.track_labels('members', ['member_admin_status', 'member_provisioning_status',
+                                          'member_operating_status'])
+        self.track_labels('hms', ['hm_admin_status', 'hm_provisioning_status',
+                                  'hm_operating_status'])
+        self.track_labels('amphorae', ['amphora_status', 'amphora_role'])
+
 
 
     def collect_api_specific_data(self):
         ###################
         # load balancer
-        current = {}
+        label_sets = self.label_sets['lbs']
+        current = []
         self.data['lbs_project_id'] = {}
-        for lb in self.openstack.load_balancer.load_balancers():
-            item = (lb.id, lb.name, lb.project_id)
-            current[item] = 1
-            self.data['lbs_project_id'][lb.id] = lb.project_id
-
-            project_name = 'none'
-            if  lb.project_id in self.data['project_name']:
-                project_name = self.data['project_name'][lb.project_id]
-            else:
-                self.disable_stats_collection('identity')
-                project = self.openstack.identity.find_project(lb.project_id)
-                self.enable_stats_collection('identity')
-                if project:
-                    self.data['project_name'][lb.project_id] = project.name
-                    project_name = project.name
-
-            self.metrics['lb_operating_status'].labels(*list(item)).state(lb.operating_status)
-            self.metrics['lb_admin_status'].labels(*list(item)).state(
-                self._admin_state_to_string(lb.is_admin_state_up))
-            self.metrics['lb_provisioning_status'].labels(*list(item)).state(
-                lb.provisioning_status)
-            self.metrics['lb_info'].labels(lb.id).info({
-                'name': lb.name,
-                'project_id': lb.project_id,
-                'project_name': project_name,
-                'vip_address': lb.vip_address,
-                'vip_port_id': lb.vip_port_id,
-            })
-
-            if not self.config['load_balancer']['collect_lb_stats']:
-                LOGGER.debug("LB stats collection is disabled. Skipping.")
-            else:
-                try:
-                    self.disable_stats_collection()
-                    stats = self.openstack.load_balancer.get_load_balancer_statistics(lb.id)
-                    LOGGER.debug(stats)
-                    self.enable_stats_collection()
-                # pylint: disable=fixme, bare-except
-                except:
-                    # It's possible that the lb disapears before retrieving the stats
-                    # -> we just ignore it then.
-                    stats = None
-                    self.enable_stats_collection()
+        with self.phase('load balancers'):
+            for lb in self.openstack.load_balancer._list(LoadBalancer, fields=LB_FIELDS):
+                item = label_sets.intern((lb.id, lb.name, lb.project_id))
+                current.append(item)
+                self.data['lbs_project_id'][item[0]] = item[2]
+
+                label_sets.child('lb_operating_status', item).state(lb.operating_status)
+                label_sets.child('lb_admin_status', item).state(
+                    self._admin_state_to_string(lb.is_admin_state_up))
+                label_sets.child('lb_provisioning_status', item).state(lb.provisioning_status)
+                label_sets.child('lb_info', item).info({
+                    'name': lb.name,
+                    'project_id': lb.project_id,
+                    'project_name': self.project_directory.name(lb.project_id),
+                    'vip_address': lb.vip_address,
+                    'vip_port_id': lb.vip_port_id,
+                })
+
+        if not self.config['load_balancer']['collect_lb_stats']:
+            LOGGER.debug("LB stats collection is disabled. Skipping.")
+        else:
+            # It's possible that a lb disapears before retrieving the stats, or that the
+            # request times out -> we just ignore it then.
+            self.disable_stats_collection()
+            try:
+                with self.phase('lb stats'):
+                    all_stats = self.fetch_concurrently(
+                        self._get_load_balancer_statistics, [item[0] for item in current],
+                        self.config['load_balancer']['lb_stats_concurrency'])
+            finally:
+                self.enable_stats_collection()
+
+            for item in current:
+                stats = all_stats[item[0]]
+                LOGGER.debug(stats)
                 if stats:
                     for measurement, attribute in self.lb_gauges.items():
-                        self.metrics[measurement].labels(*list(item)).set(stats[attribute])
-                    for measurement, attribute in self.lb_couters.items():
-                        if item in self.data['lb_counters_current'][measurement]:
-                            diff = stats[attribute] - self.data['lb_counters_current'][measurement][item]
+                        label_sets.child(measurement, item).set(stats[attribute])
+                    last_values = self.data['lb_counters_current'].get(item)
+                    values = tuple(stats[attribute] for attribute in self.lb_couters.values())
+                    for position, measurement in enumerate(self.lb_couters):
+                        if last_values:
+                            diff = values[position] - last_values[position]
                             if diff > 0:
                                 # it is possible that counters are reset -> the prometheus lib does not like that.
                                 # not sure if ignoreing this fact is the proper thing to do though
-                                self.metrics[measurement].labels(*list(item)).inc(diff)
+                                label_sets.child(measurement, item).inc(diff)
                         else:
-                            self.metrics[measurement].labels(*list(item)).inc(0)
-                        self.data['lb_counters_current'][measurement][item] = stats[attribute]
+                            label_sets.child(measurement, item).inc(0)
+                    self.data['lb_counters_current'][item] = values
 
         # remove lbs which are no longer present
-        for item in self.data['lbs']:
-            if item not in current:
-                LOGGER.debug("Removing lb: {}".format(item))
-                self.savely_remove_labels('lb_operating_status', item)
-                self.savely_remove_labels('lb_admin_status', item)
-                self.savely_remove_labels('lb_provisioning_status', item)
-                self.savely_remove_labels('lb_info', item)
-                for measurement in self.lb_gauges:
-                    self.savely_remove_labels(measurement, item)
-                for measurement in self.lb_couters:
-                    self.savely_remove_labels(measurement, item)
-                    if item in self.data['lb_counters_current'][measurement]:
-                        del self.data['lb_counters_current'][measurement][item]
-        self.data['lbs'] = current
+        for item in label_sets.reconcile():
+            self.data['lb_counters_current'].pop(item, None)
 
         ###################
         # listener
-        current = {}
-        for listener in self.openstack.load_balancer.listeners():
-            lbs = []
-            for lb in listener.load_balancers:
-                lbs.append(lb['id'])
-            lbs = ",".join(lbs)
-            item = (listener.id, listener.name, listener.project_id, lbs)
-            current[item] = 1
-
-            # we ignore traffic stats for now
-            #stats = self.openstack.load_balancer.get_listener_statistics(listener.id)
-
-            self.metrics['listener_admin_status'].labels(*list(item)).state(
-                self._admin_state_to_string(listener.is_admin_state_up))
-            self.metrics['listener_provisioning_status'].labels(*list(item)).state(
-                listener.provisioning_status)
-            self.metrics['listener_operating_status'].labels(*list(item)).state(
-                listener.operating_status)
-            self.metrics['listener_connection_limit'].labels(*list(item)).set(
-                listener.connection_limit)
+        label_sets = self.label_sets['listeners']
+        with self.phase('listeners'):
+            for listener in self.openstack.load_balancer._list(Listener, fields=LISTENER_FIELDS):
+                lbs = []
+                for lb in listener.load_balancers:
+                    lbs.append(lb['id'])
+                lbs = ",".join(lbs)
+                item = (listener.id, listener.name, listener.project_id, lbs)
+
+                # we ignore traffic stats for now
+                #stats = self.openstack.load_balancer.get_listener_statistics(listener.id)
+
+                label_sets.child('listener_admin_status', item).state(
+                    self._admin_state_to_string(listener.is_admin_state_up))
+                label_sets.child('listener_provisioning_status', item).state(
+                    listener.provisioning_status)
+                label_sets.child('listener_operating_status', item).state(
+                    listener.operating_status)
+                label_sets.child('listener_connection_limit', item).set(
+                    listener.connection_limit)
 
         # remove listeneners which are no longer present
-        for item in self.data['listeneners']:
-            if item not in current:
-                LOGGER.debug("Removing listener: {}".format(item))
-                self.savely_remove_labels('listener_admin_status', item)
-                self.savely_remove_labels('listener_provisioning_status', item)
-                self.savely_remove_labels('listener_operating_status', item)
-                self.savely_remove_labels('listener_connection_limit', item)
-        self.data['listeneners'] = current
+        label_sets.reconcile()
 
         ###################
         # pool
-        current = {}
-        for pool in self.openstack.load_balancer.pools():
-            lbs = []
-            for lb in pool.loadbalancers:
-                lbs.append(lb['id'])
-            lbs = ",".join(lbs)
-            listeners = []
-            for listener in pool.listeners:
-                listeners.append(listener['id'])
-            listeners = ",".join(listeners)
-            item = (pool.id, pool.name, pool.project_id, lbs, listeners)
-            current[item] = 1
-            self.data['pools_data']['lbs'][pool.id] = lbs
-            self.data['pools_data']['listeners'][pool.id] = listeners
-
-            self.metrics['pool_admin_status'].labels(*list(item)).state(
-                self._admin_state_to_string(pool.is_admin_state_up))
-            self.metrics['pool_provisioning_status'].labels(*list(item)).state(
-                pool.provisioning_status)
-            self.metrics['pool_operating_status'].labels(*list(item)).state(
-                pool.operating_status)
-
-            ###################
-            # member
-            if not self.config['load_balancer']['collect_member_stats']:
-                LOGGER.debug("LB Member stats collection is disabled. Skipping.")
-            else:
-                current_member = {}
-                if not pool.id in self.data['members']:
-                    self.data['members'][pool.id] = {}
-
-                try:
-                    self.disable_stats_collection()
-                    for member in self.openstack.load_balancer.members(pool.id):
-                        member_item = (member.id, member.name, pool.project_id, lbs, listeners, pool.id)
-                        current_member[member_item] = 1
-
-                        self.metrics['member_admin_status'].labels(*list(member_item)).state(
-                            self._admin_state_to_string(member.is_admin_state_up))
-                        self.metrics['member_provisioning_status'].labels(*list(member_item)).state(
-                            pool.provisioning_status)
-                        self.metrics['member_operating_status'].labels(*list(member_item)).state(
-                            pool.operating_status)
-                    self.enable_stats_collection()
-
-                except ResourceNotFound:
-                    # it is possible that the pool was removed in the meantime
-                    # -> we ignore the members then.
-                    self.enable_stats_collection()
-
-                # remove pools which are no longer present
-                for member_item in self.data['members'][pool.id]:
-                    if member_item not in current_member:
-                        LOGGER.debug("Removing member: {}".format(member_item))
-                        self.savely_remove_labels('member_admin_status', member_item)
-                        self.savely_remove_labels('member_provisioning_status', member_item)
-                        self.savely_remove_labels('member_operating_status', member_item)
-                self.data['members'][pool.id] = current_member
+        label_sets = self.label_sets['pools']
+        current = []
+        pools = {}
+        # only keep the pools that still exist
+        self.data['pools_data'] = {'lbs': {}, 'listeners': {}}
+        with self.phase('pools'):
+            for pool in self.openstack.load_balancer._list(Pool, fields=POOL_FIELDS):
+                lbs = []
+                for lb in pool.loadbalancers:
+                    lbs.append(lb['id'])
+                lbs = ",".join(lbs)
+                listeners = []
+                for listener in pool.listeners:
+                    listeners.append(listener['id'])
+                listeners = ",".join(listeners)
+                item = label_sets.intern((pool.id, pool.name, pool.project_id, lbs, listeners))
+                current.append(item)
+                pools[pool.id] = pool
+                self.data['pools_data']['lbs'][item[0]] = item[3]
+                self.data['pools_data']['listeners'][item[0]] = item[4]
+
+                label_sets.child('pool_admin_status', item).state(
+                    self._admin_state_to_string(pool.is_admin_state_up))
+                label_sets.child('pool_provisioning_status', item).state(
+                    pool.provisioning_status)
+                label_sets.child('pool_operating_status', item).state(
+                    pool.operating_status)
 
         # remove pools which are no longer present
-        for item in self.data['pools']:
-            if item not in current:
-                LOGGER.debug("Removing pool: {}".format(item))
-                self.savely_remove_labels('pool_admin_status', item)
-                self.savely_remove_labels('pool_provisioning_status', item)
-                self.savely_remove_labels('pool_operating_status', item)
+        label_sets.reconcile()
 
-                # also remmove all members in that pool
-                if item[0] in self.data['members']:
-                    for member_item in self.data['members'][item[0]]:
-                        LOGGER.debug("Removing member: {}".format(member_item))
-                        self.savely_remove_labels('member_admin_status', member_item)
-                        self.savely_remove_labels('member_provisioning_status', member_item)
-                        self.savely_remove_labels('member_operating_status', member_item)
-                    del self.data['members'][item[0]]
-
-        self.data['pools'] = current
+        ###################
+        # member
+        if not self.config['load_balancer']['collect_member_stats']:
+            LOGGER.debug("LB Member stats collection is disabled. Skipping.")
+        else:
+            # octavia only lists members per pool -> fetch the pools in parallel. It is possible
+            # that a pool was removed in the meantime -> we ignore the members then.
+            self.disable_stats_collection()
+            try:
+                with self.phase('members'):
+                    all_members = self.fetch_concurrently(
+                        lambda pool_id: list(self.openstack.load_balancer._list(
+                            Member, pool_id=pool_id, fields=MEMBER_FIELDS)),
+                        [item[0] for item in current],
+                        self.config['load_balancer']['member_concurrency'],
+                        ignored_exceptions=(ResourceNotFound,))
+            finally:
+                self.enable_stats_collection()
+
+            label_sets = self.label_sets['members']
+            for pool_id, _, project_id, lbs, listeners in current:
+                pool = pools[pool_id]
+                for member in all_members[pool_id] or []:
+                    member_item = (member.id, member.name, project_id, lbs, listeners, pool_id)
+
+                    label_sets.child('member_admin_status', member_item).state(
+                        self._admin_state_to_string(member.is_admin_state_up))
+                    label_sets.child('member_provisioning_status', member_item).state(
+                        pool.provisioning_status)
+                    label_sets.child('member_operating_status', member_item).state(
+                        pool.operating_status)
+
+            # remove members which are no longer present, including those of removed pools
+            label_sets.reconcile()
 
 
         ###################
         # health monitors
-        current = {}
-        for hm in self.openstack.load_balancer.health_monitors():
-            pools = []
-            lbs = []
-            listeners = []
-
-            for pool in hm.pools:
-                pools.append(pool['id'])
-                lbs.append(self.data['pools_data']['lbs'][pool['id']])
-                listeners.append(self.data['pools_data']['listeners'][pool['id']])
-            pools = ",".join(pools)
-            lbs = ",".join(lbs)
-            listeners = ",".join(listeners)
-
-            item = (hm.id, hm.name, hm.project_id, lbs, listeners, pools)
-            current[item] = 1
-
-            if hm.is_admin_state_up:
-                admin_status = "enabled"
-            else:
-                admin_status = "disabled"
-            self.metrics['hm_admin_status'].labels(*list(item)).state(admin_status)
-            self.metrics['hm_provisioning_status'].labels(*list(item)).state(hm.provisioning_status)
-            self.metrics['hm_operating_status'].labels(*list(item)).state(hm.operating_status)
-
-        # remove pools which are no longer present
-        for item in self.data['hms']:
-            if item not in current:
-                LOGGER.debug("Removing health moniter: {}".format(item))
-                self.savely_remove_labels('hm_admin_status', item)
-                self.savely_remove_labels('hm_provisioning_status', item)
-                self.savely_remove_labels('hm_operating_status', item)
-        self.data['hms'] = current
+        label_sets = self.label_sets['hms']
+        with self.phase('health monitors'):
+            for hm in self.openstack.load_balancer._list(HealthMonitor, fields=HM_FIELDS):
+                pools = []
+                lbs = []
+                listeners = []
+
+                for pool in hm.pools:
+                    pools.append(pool['id'])
+                    lbs.append(self.data['pools_data']['lbs'][pool['id']])
+                    listeners.append(self.data['pools_data']['listeners'][pool['id']])
+                pools = ",".join(pools)
+                lbs = ",".join(lbs)
+                listeners = ",".join(listeners)
+
+                item = (hm.id, hm.name, hm.project_id, lbs, listeners, pools)
+
+                if hm.is_admin_state_up:
+                    admin_status = "enabled"
+                else:
+                    admin_status = "disabled"
+                label_sets.child('hm_admin_status', item).state(admin_status)
+                label_sets.child('hm_provisioning_status', item).state(hm.provisioning_status)
+                label_sets.child('hm_operating_status', item).state(hm.operating_status)
+
+        # remove health monitors which are no longer present
+        label_sets.reconcile()
 
 
         ###################
         # amphorae
-        current = {}
-        for amphora in self.openstack.load_balancer.amphorae():
-
-            if amphora.loadbalancer_id in self.data['lbs_project_id']:
-                project_id = self.data['lbs_project_id'][amphora.loadbalancer_id]
-            else:
-                project_id = 'None'
-            item = (amphora.id, amphora.loadbalancer_id, project_id)
-            current[item] = 1
-
-            self.metrics['amphora_status'].labels(*list(item)).state(amphora.status)
-            if amphora.role:
-                self.metrics['amphora_role'].labels(*list(item)).state(amphora.role)
-
-        # remove pools which are no longer present
-        for item in self.data['amphorae']:
-            if item not in current:
-                LOGGER.debug("Removing amphora: {}".format(item))
-                self.savely_remove_labels('amphora_status', item)
-                self.savely_remove_labels('amphora_role', item)
-                # self.savely_remove_labels('amphora_cert_expiration', item)
-        self.data['amphorae'] = current
+        label_sets = self.label_sets['amphorae']
+        with self.phase('amphorae'):
+            for amphora in self.openstack.load_balancer._list(Amphora, fields=AMPHORA_FIELDS):
+
+                if amphora.loadbalancer_id in self.data['lbs_project_id']:
+                    project_id = self.data['lbs_project_id'][amphora.loadbalancer_id]
+                else:
+                    project_id = 'None'
+                item = (amphora.id, amphora.loadbalancer_id, project_id)
+
+                label_sets.child('amphora_status', item).state(amphora.status)
+                if amphora.role:
+                    label_sets.child('amphora_role', item).state(amphora.role)
+
+        # remove amphorae which are no longer present
+        label_sets.reconcile()
@@ -2,11 +2,17 @@
 Networking / Neutron
 """
 import logging
+import time
+import traceback
 from prometheus_client import Gauge
 from collector_api_base import CollectorAPIBase
 from resources_dummy import DummyApiVersions
+from resources_network import FloatingIP, Router
 
 LOGGER = logging.getLogger(__name__)
+# only these fields are requested from neutron
+FLOATING_IP_FIELDS = ['id', 'project_id', 'status']
+ROUTER_FIELDS = ['id', 'status']
 
 class CollectorAPINetwork(CollectorAPIBase):
     """
@@ -20,11 +26,15 @@ class CollectorAPINetwork(CollectorAPIBase):
             metrics,
             api_name,
             project_name,
-            name_prefix
+            name_prefix,
+            project_directory=None,
+            discovery_cache=None
         ):
         self.data = {}
         super().__init__(config, openstack, metrics, api_name, project_name, name_prefix,
-                         [DummyApiVersions])
+                         [DummyApiVersions],
+                         project_directory=project_directory,
+                         discovery_cache=discovery_cache)
 
 
     def collect_micro_service_state(self):
@@ -43,43 +53,104 @@ class CollectorAPINetwork(CollectorAPIBase):
         self._update_micro_service_metrics(services)
 
     def init_metrics(self):
-        self.data['floating_ips'] = {}
         self.metrics['floating_ips'] = Gauge(
-            self.name_prefix + 'floating_ips', '', ['project_id', 'status'])
+            self.name_prefix + 'floating_ips', '', ['project_id', 'status'], registry=self.registry)
+        self.track_labels('floating_ips', ['floating_ips'])
 
         self.data['routers'] = {}
         self.metrics['routers'] = Gauge(
-            self.name_prefix + 'routers', '', ['status'])
+            self.name_prefix + 'routers', '', ['status'], registry=self.registry)
+        self.track_labels('routers', ['routers'])
+
+        # ip availability is only listed every ip_availability_interval seconds, the metrics keep
+        # the values of the last listing in between
+        self.data['ip_availability_updated'] = None
+        # whether the last listing failed, the failure is only logged as warning once
+        self.data['ip_availability_failed'] = False
+        network_labels = ['network_id', 'network_name', 'project_id']
+        subnet_labels = ['subnet_id', 'subnet_name', 'cidr'] + network_labels
+        for name, labels in (('network', network_labels), ('subnet', subnet_labels)):
+            self.metrics[name + '_ips_total'] = Gauge(
+                self.name_prefix + name + '_ips_total', '', labels, registry=self.registry)
+            self.metrics[name + '_ips_used'] = Gauge(
+                self.name_prefix + name + '_ips_used', '', labels, registry=self.registry)
+        self.track_labels('networks', ['network_ips_total', 'network_ips_used'])
+        self.track_labels('subnets', ['subnet_ips_total', 'subnet_ips_used'])
 
     def collect_api_specific_data(self):
         # floating ips
         data = {}
-        for fip in self.openstack.network.ips():
-            if not fip.project_id in data:
-                data[fip.project_id] = {}
-            if not fip.status in data[fip.project_id]:
-                data[fip.project_id][fip.status] = 0
-            data[fip.project_id][fip.status] += 1
-            LOGGER.debug("Floating IP; project: {}, status: {}".format(fip.project_id, fip.status))
+        with self.phase('floating ips'):
+            for fip in self.openstack.network._list(FloatingIP, fields=FLOATING_IP_FIELDS):
+                if not fip.project_id in data:
+                    data[fip.project_id] = {}
+                if not fip.status in data[fip.project_id]:
+                    data[fip.project_id][fip.status] = 0
+                data[fip.project_id][fip.status] += 1
+                LOGGER.debug("Floating IP; project: {}, status: {}".format(fip.project_id, fip.status))
+        label_sets = self.label_sets['floating_ips']
         for project in data:
             for status in data[project]:
-                self.metrics['floating_ips'].labels(project, status).set(data[project][status])
+                label_sets.child('floating_ips', (project, status)).set(data[project][status])
 
         # remove stuff that is gone
-        for project in self.data['floating_ips']:
-            for status in self.data['floating_ips'][project]:
-                if not project in data or not status in data[project]:
-                    self.savely_remove_labels('floating_ips', (project, status))
-        self.data['floating_ips'] = data
+        label_sets.reconcile()
 
         # routers
         data = {}
         for status in self.data['routers']:
             data[status] = 0
-        for router in self.openstack.network.routers():
-            if not router.status in data:
-                data[router.status] = 0
-            data[router.status] += 1
+        with self.phase('routers'):
+            for router in self.openstack.network._list(Router, fields=ROUTER_FIELDS):
+                if not router.status in data:
+                    data[router.status] = 0
+                data[router.status] += 1
+        # statuses seen before are kept with a count of 0
         for status in data:
-            self.metrics['routers'].labels(status).set(data[status])
+            self.label_sets['routers'].child('routers', (status,)).set(data[status])
         self.data['routers'] = data
+
+        # ip availability of all networks and subnets, one listing
+        interval = self.config['network']['ip_availability_interval']
+        if not self.config['network']['collect_ip_availability']:
+            LOGGER.debug("IP availability collection is disabled. Skipping.")
+        elif (self.data['ip_availability_updated'] is None or
+              time.monotonic() - self.data['ip_availability_updated'] >= interval):
+            # failures are only retried after the interval too, e.g. when the listing is
+            # forbidden by the policy
+            self.data['ip_availability_updated'] = time.monotonic()
+            with self.phase('ip availability'):
+                try:
+                    self._collect_ip_availability()
+                    self.data['ip_availability_failed'] = False
+                # pylint: disable=fixme, broad-except
+                except Exception:
+                    self._ip_availability_failed()
+
+    def _ip_availability_failed(self):
+        # keep the values of the last listing, forget the label sets of this one
+        self.label_sets['networks'].begin()
+        self.label_sets['subnets'].begin()
+        if not self.data['ip_availability_failed']:
+            LOGGER.warning("Listing the network ip availability failed, keeping the last values. "
+                           "Retried every {} seconds.".format(
+                               self.config['network']['ip_availability_interval']))
+        self.data['ip_availability_failed'] = True
+        LOGGER.debug(traceback.format_exc())
+
+    def _collect_ip_availability(self):
+        networks = self.label_sets['networks']
+        subnets = self.label_sets['subnets']
+        for availability in self.openstack.network.network_ip_availabilities():
+            network_item = (availability.network_id, availability.network_name,
+                            availability.project_id)
+            networks.child('network_ips_total', network_item).set(availability.total_ips)
+            networks.child('network_ips_used', network_item).set(availability.used_ips)
+            for subnet in availability.subnet_ip_availability or []:
+                subnet_item = (subnet['subnet_id'], subnet['subnet_name'], subnet['cidr'])
+                subnet_item += network_item
+                subnets.child('subnet_ips_total', subnet_item).set(subnet['total_ips'])
+                subnets.child('subnet_ips_used', subnet_item).set(subnet['used_ips'])
+        # remove networks and subnets which are no longer present
+        networks.reconcile()
+        subnets.reconcile()
@@ -0,0 +1,144 @@
+"""
+Cache of the service catalog and api version discovery
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+def fetch_version_data(openstack, service_type):
+    """
+    discover the versions of an api. Returns a list of dicts with the version fields exported
+    in the api_info metric.
+    """
+    versions = []
+    for version in openstack.config.get_all_version_data(service_type):
+        LOGGER.debug(version)
+        versions.append({
+            'status': str(version.status),
+            'version': str(version.version),
+            'min_microversion': str(version.min_microversion),
+            'max_microversion': str(version.max_microversion)
+        })
+    return versions
+
+
+class DiscoveryCache():
+    """
+    Services of the catalog (with normalized service types) and version data of the apis. Both
+    are discovered on first use. If a directory is given, the discovered data is stored there and
+    loaded again by the next start of the exporter, as long as it is not older than `ttl` seconds,
+    so the collectors can be built without waiting for discovery.
+    """
+    def __init__(
+            self,
+            openstack,
+            directory=None,
+            ttl=86400
+        ):
+        self.openstack = openstack
+        self.directory = directory
+        self.ttl = ttl
+        # [(service name, service type)]
+        self.services = None
+        # service type -> version data
+        self.versions = {}
+        # data was loaded from disk, it still needs to be rediscovered
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def path(self):
+        """
+        cache file of the cloud and region we are connected to
+        """
+        cloud = self.openstack.config
+        key = json.dumps([cloud.config.get('auth', {}).get('auth_url'), cloud.region_name,
+                          cloud.config.get('auth', {}).get('project_name')])
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def load(self):
+        """
+        load the data discovered by an earlier start, if it is fresh enough
+        """
+        if not self.directory:
+            return False
+        try:
+            with open(self.path()) as cache_file:
+                data = json.load(cache_file)
+        except FileNotFoundError:
+            return False
+        # pylint: disable=fixme, broad-except
+        except Exception as exc:
+            LOGGER.warning("Could not load the discovery cache: {}".format(exc))
+            return False
+        if time.time() - data['created'] > self.ttl:
+            LOGGER.info("Discovery cache is older than {} seconds, not using it.".format(self.ttl))
+            return False
+        self.services = [tuple(service) for service in data['services']]
+        self.versions = data['versions']
+        self.loaded = True
+        LOGGER.info("Using discovery cache from {}".format(time.ctime(data['created'])))
+        return True
+
+    def save(self):
+        """
+        store the discovered data, written to a temporary file first so readers never see a
+        partial one
+        """
+        if not self.directory:
+            return
+        with self.lock:
+            data = {'created': time.time(), 'services': self.services, 'versions': self.versions}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.path()
+            with open(path + '.tmp', 'w') as cache_file:
+                json.dump(data, cache_file)
+            os.replace(path + '.tmp', path)
+        except OSError as exc:
+            # the exporter works without the cache
+            LOGGER.warning("Could not store the discovery cache: {}".format(exc))
+
+    def discover_services(self):
+        """
+        list the services of the catalog
+        """
+        services = []
+        for service in self.openstack.list_services():
+            # normalize service_type name
+            service_type = self.openstack.config.get_service_type(
+                service.get('service_type') or service.get('type'))
+            services.append((service.name, service_type))
+        with self.lock:
+            self.services = services
+        return services
+
+    def discover_versions(self, service_type):
+        """
+        discover the versions of an api
+        """
+        versions = fetch_version_data(self.openstack, service_type)
+        with self.lock:
+            self.versions[service_type] = versions
+        return versions
+
+    def get_services(self):
+        """
+        services of the catalog, discovered on first use
+        """
+        if self.services is None:
+            return self.discover_services()
+        return self.services
+
+    def get_versions(self, service_type):
+        """
+        version data of an api, discovered on first use
+        """
+        if service_type not in self.versions:
+            return self.discover_versions(service_type)
+        return self.versions[service_type]
@@ -0,0 +1,159 @@
+"""
+Cached /metrics exposition. The metrics are rendered once per collector run instead of on every
+scrape.
+"""
+import gzip
+import logging
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from prometheus_client import REGISTRY
+from prometheus_client.exposition import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.openmetrics.exposition import CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE
+from prometheus_client.openmetrics.exposition import generate_latest as generate_latest_openmetrics
+
+LOGGER = logging.getLogger(__name__)
+METRICS_PATH = '/metrics'
+
+
+def accepts(header, value):
+    """
+    whether an Accept or Accept-Encoding header accepts value, i.e. lists it without a q-value
+    of 0
+    """
+    for part in (header or '').split(','):
+        name, *parameters = [item.strip() for item in part.split(';')]
+        if name.lower() != value:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            key, _, number = parameter.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            return True
+    return False
+
+
+class ExpositionCache():
+    """
+    Holds the rendered metrics until the next collector run. Every variant (classic text format
+    or OpenMetrics, plain or gzip compressed) is rendered on the first scrape asking for it, so
+    collector runs only invalidate the pages and variants nobody asks for are never rendered.
+    """
+    def __init__(
+            self,
+            registry=REGISTRY
+        ):
+        self.registry = registry
+        # (openmetrics, gzip) -> bytes, rendered since the last invalidate()
+        self.pages = {}
+        # held while rendering, concurrent scrapes wait for the same rendering
+        self.render_lock = threading.Lock()
+        # calls of invalidate(), and how many of them the pages include
+        self.invalidations = 0
+        self.rendered = 0
+        self.invalidations_lock = threading.Lock()
+        # functions called before a scrape is served, e.g. to refresh old collections
+        self.scrape_callbacks = []
+
+    def page(self, openmetrics, compress):
+        """
+        the rendered metrics in the given format, rendered if they changed since the last
+        rendering. Must be called with the render_lock held.
+        """
+        invalidations = self.invalidations
+        if self.rendered != invalidations:
+            self.pages = {}
+            self.rendered = invalidations
+        key = (openmetrics, compress)
+        if key not in self.pages:
+            if compress:
+                self.pages[key] = gzip.compress(self.page(openmetrics, False), compresslevel=6)
+            elif openmetrics:
+                self.pages[key] = generate_latest_openmetrics(self.registry)
+            else:
+                self.pages[key] = generate_latest(self.registry)
+            LOGGER.debug("Rendered metrics {}: {} bytes".format(key, len(self.pages[key])))
+        return self.pages[key]
+
+    def invalidate(self):
+        """
+        drop the rendered pages, the next scrape renders the metrics again
+        """
+        with self.invalidations_lock:
+            self.invalidations += 1
+
+    def get(self, accept, accept_encoding):
+        """
+        get content type, content encoding and body for a request with the given headers
+        """
+        # the callbacks invalidate the pages if they collected something, the scrape then
+        # serves it rather than the previous rendering
+        for callback in self.scrape_callbacks:
+            callback()
+        openmetrics = accepts(accept, 'application/openmetrics-text')
+        compress = accepts(accept_encoding, 'gzip')
+        if openmetrics:
+            content_type = OPENMETRICS_CONTENT_TYPE
+        else:
+            content_type = CONTENT_TYPE_LATEST
+        encoding = None
+        if compress:
+            encoding = 'gzip'
+        with self.render_lock:
+            body = self.page(openmetrics, compress)
+        return content_type, encoding, body
+
+
+def start_http_server(port, cache, addr='0.0.0.0'):
+    """
+    serve the cached metrics, replaces prometheus_client.start_http_server
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """
+        serve the pre-rendered metrics on /metrics
+        """
+        # headers and body are written separately, don't let them wait for each other
+        disable_nagle_algorithm = True
+
+        # pylint: disable=fixme, invalid-name
+        def do_GET(self):
+            if urlsplit(self.path).path != METRICS_PATH:
+                self.send_error(404)
+                return
+            try:
+                content_type, encoding, body = cache.get(
+                    self.headers.get('Accept'), self.headers.get('Accept-Encoding'))
+            # pylint: disable=fixme, broad-except
+            except Exception:
+                LOGGER.error("Serving the metrics failed.")
+                LOGGER.error(traceback.format_exc())
+                self.send_error(500)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.send_header('Vary', 'Accept, Accept-Encoding')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # pylint: disable=fixme, redefined-builtin
+        def log_message(self, format, *args):
+            LOGGER.debug(format, *args)
+
+    class MetricsServer(ThreadingHTTPServer):
+        """
+        threaded http server, without blocking the exit of the exporter
+        """
+        daemon_threads = True
+
+    server = MetricsServer((addr, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
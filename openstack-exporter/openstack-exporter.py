@@ -10,11 +10,23 @@ import logging
 import traceback
 import threading
 import time
-import queue
+from concurrent.futures import wait
+import startup_profile
+
+# imports are only profiled with OS_EXPORTER_STARTUP_PROFILE, it has to be installed before them
+STARTUP_PROFILE = startup_profile.StartupProfile()
+if os.getenv("OS_EXPORTER_STARTUP_PROFILE", "False").lower() in (True, 'true', '1', 't'):
+    STARTUP_PROFILE.install()
+
+# pylint: disable=fixme, wrong-import-position
 import schedule
-from prometheus_client import start_http_server
+import prometheus_client
 
 from collector import Collector
+from snapshot_collector import SnapshotCollector
+import exposition
+import replica
+import scrape_refresh
 
 LOGGER = logging.getLogger(__name__)
 
@@ -38,11 +50,27 @@ def get_config():
 
     configuration = {}
     configuration["load_balancer"] = dict()
+    configuration["block_storage"] = dict()
+    configuration["network"] = dict()
+
+    # clouds (from clouds.yaml) and / or regions to collect: [(cloud, region)], None means the
+    # default, taken from the OS_* environment variables
+    configuration['clouds'] = []
+    for entry in os.getenv('OS_EXPORTER_CLOUDS', default="").split(','):
+        if entry.strip():
+            cloud, _, region = entry.strip().partition(':')
+            configuration['clouds'].append((cloud or None, region or None))
 
     # check that mandatory openstack environment variables are present
     # we don't read them into config since openstacksdk get's them directly from the environment
     # pylint: disable=fixme, line-too-long
-    for param in ['OS_AUTH_URL', 'OS_PROJECT_NAME', 'OS_USERNAME', 'OS_PASSWORD', 'OS_REGION_NAME', 'OS_USER_DOMAIN_NAME', 'OS_PROJECT_DOMAIN_NAME']:
+    params = ['OS_AUTH_URL', 'OS_PROJECT_NAME', 'OS_USERNAME', 'OS_PASSWORD', 'OS_REGION_NAME', 'OS_USER_DOMAIN_NAME', 'OS_PROJECT_DOMAIN_NAME']
+    if any(cloud for cloud, _ in configuration['clouds']):
+        # credentials are taken from clouds.yaml
+        params = []
+    elif configuration['clouds']:
+        params.remove('OS_REGION_NAME')
+    for param in params:
         LOGGER.debug(os.environ)
         if not os.getenv(param, default=False):
             LOGGER.error('Environment variable %s is not defined', param)
@@ -53,14 +81,134 @@ def get_config():
     configuration['listen-port'] = int(os.getenv('OS_EXPORTER_LISTEN_PORT', default=9103))
     configuration['metric_prefix'] = os.getenv('OS_EXPORTER_METRIC_PREFIX', default='openstack')
     configuration['interval'] = int(os.getenv('OS_EXPORTER_INTERVAL_SECONDS', default=60))
+    configuration['project_cache_ttl'] = int(os.getenv('OS_EXPORTER_PROJECT_CACHE_TTL_SECONDS', default=3600))
+    # per api intervals, e.g. OS_EXPORTER_INTERVAL_SECONDS_LOAD_BALANCER for the load-balancer api
+    configuration['api_intervals'] = {}
+    for name, value in os.environ.items():
+        if name.startswith('OS_EXPORTER_INTERVAL_SECONDS_'):
+            api_name = name[len('OS_EXPORTER_INTERVAL_SECONDS_'):].lower().replace('_', '-')
+            configuration['api_intervals'][api_name] = int(value)
+    configuration['exposition_cache'] = os.getenv("OS_EXPORTER_EXPOSITION_CACHE", "False").lower() in (True, 'true', '1', 't')
+    configuration['replica_dir'] = os.getenv('OS_EXPORTER_REPLICA_DIR', default=None)
+    configuration['replica_lease_time'] = float(os.getenv('OS_EXPORTER_REPLICA_LEASE_SECONDS', default=30))
+    configuration['scrape_driven'] = os.getenv("OS_EXPORTER_SCRAPE_DRIVEN", "False").lower() in (True, 'true', '1', 't')
+    configuration['scrape_deadline'] = float(os.getenv('OS_EXPORTER_SCRAPE_DEADLINE_SECONDS', default=5))
+    if configuration['scrape_driven'] and configuration['replica_dir']:
+        LOGGER.error('OS_EXPORTER_SCRAPE_DRIVEN can not be used with OS_EXPORTER_REPLICA_DIR')
+        sys.exit(1)
+    # the metrics of several clouds are always served from snapshots, labeled with their cloud,
+    # as are the metrics shared by replicas and those of scrape driven collections, so slow
+    # collections serve their last complete run
+    configuration['snapshot_mode'] = bool(configuration['clouds'] or configuration['replica_dir'] or configuration['scrape_driven']) or os.getenv("OS_EXPORTER_SNAPSHOT_MODE", "False").lower() in (True, 'true', '1', 't')
+    configuration['collector_workers'] = max(1, int(os.getenv('OS_EXPORTER_COLLECTOR_WORKERS', default=1)))
+    configuration['startup_profile'] = os.getenv("OS_EXPORTER_STARTUP_PROFILE", "False").lower() in (True, 'true', '1', 't')
+    configuration['token_cache_dir'] = os.getenv('OS_EXPORTER_TOKEN_CACHE_DIR', default=None)
+    configuration['token_refresh_margin'] = int(os.getenv('OS_EXPORTER_TOKEN_REFRESH_MARGIN_SECONDS', default=900))
+    configuration['discovery_cache_dir'] = os.getenv('OS_EXPORTER_DISCOVERY_CACHE_DIR', default=None)
+    configuration['discovery_cache_ttl'] = int(os.getenv('OS_EXPORTER_DISCOVERY_CACHE_TTL_SECONDS', default=86400))
+
+    # request scheduler, bounds the load on the cloud no matter how many collectors and threads run
+    configuration['max_in_flight'] = int(os.getenv('OS_EXPORTER_MAX_IN_FLIGHT_REQUESTS', default=0))
+    # per api limits, e.g. OS_EXPORTER_MAX_IN_FLIGHT_REQUESTS_LOAD_BALANCER for the load-balancer api
+    configuration['api_max_in_flight'] = {}
+    for name, value in os.environ.items():
+        if name.startswith('OS_EXPORTER_MAX_IN_FLIGHT_REQUESTS_'):
+            api_name = name[len('OS_EXPORTER_MAX_IN_FLIGHT_REQUESTS_'):].lower().replace('_', '-')
+            configuration['api_max_in_flight'][api_name] = int(value)
+    configuration['max_requests_per_second'] = float(os.getenv('OS_EXPORTER_MAX_REQUESTS_PER_SECOND', default=0))
+    configuration['request_retries'] = int(os.getenv('OS_EXPORTER_REQUEST_RETRIES', default=0))
+    configuration['max_backoff'] = float(os.getenv('OS_EXPORTER_MAX_BACKOFF_SECONDS', default=60))
+    # keep-alive connection pools, one per api endpoint host
+    configuration['http_pool_connections'] = int(os.getenv('OS_EXPORTER_HTTP_POOL_CONNECTIONS', default=10))
+    configuration['http_pool_maxsize'] = int(os.getenv('OS_EXPORTER_HTTP_POOL_MAXSIZE', default=10))
+    configuration['http_idle_timeout'] = float(os.getenv('OS_EXPORTER_HTTP_IDLE_TIMEOUT_SECONDS', default=0))
 
     # colllection specific config
     configuration['api-exclude'] = os.getenv('OS_EXPORTER_API_EXCLUDE', default="").split(',')
+    configuration['block_storage']['volumes_full_sync_interval'] = int(os.getenv("OS_EXPORTER_VOLUMES_FULL_SYNC_SECONDS", default=0))
+    configuration['block_storage']['volumes_detail'] = os.getenv("OS_EXPORTER_VOLUMES_DETAIL", default='problems').lower()
+    if configuration['block_storage']['volumes_detail'] not in ('all', 'problems', 'none'):
+        LOGGER.error('OS_EXPORTER_VOLUMES_DETAIL must be one of all, problems or none')
+        sys.exit(1)
+    configuration['block_storage']['volumes_stuck_time'] = int(os.getenv("OS_EXPORTER_VOLUMES_STUCK_SECONDS", default=300))
+    configuration['network']['collect_ip_availability'] = os.getenv("OS_EXPORTER_NETWORK_COLLECT_IP_AVAILABILITY", "True").lower() in (True, 'true', '1', 't')
+    configuration['network']['ip_availability_interval'] = int(os.getenv("OS_EXPORTER_NETWORK_IP_AVAILABILITY_INTERVAL_SECONDS", default=300))
     configuration['load_balancer']['collect_member_stats'] = os.getenv("OS_EXPORTER_LB_COLLECT_MEMBER_STATS", "True").lower() in (True, 'true', '1', 't')
+    configuration['load_balancer']['member_concurrency'] = int(os.getenv("OS_EXPORTER_LB_MEMBER_CONCURRENCY", default=1))
     configuration['load_balancer']['collect_lb_stats'] = os.getenv("OS_EXPORTER_LB_COLLECT_LB_STATS", "True").lower() in (True, 'true', '1', 't')
+    configuration['load_balancer']['lb_stats_concurrency'] = int(os.getenv("OS_EXPORTER_LB_STATS_CONCURRENCY", default=1))
+    configuration['load_balancer']['lb_stats_timeout'] = float(os.getenv("OS_EXPORTER_LB_STATS_TIMEOUT_SECONDS", default=10))
 
     return configuration
 
+def start_metrics_server(config, refresher=None):
+    """
+    start the web server prometheus polls. Returns the exposition cache, if one is used. If
+    refresher (a ScrapeRefresh) is given, every scrape refreshes the collections first.
+    """
+    if config['exposition_cache']:
+        cache = exposition.ExpositionCache()
+        if refresher:
+            cache.scrape_callbacks.append(refresher.refresh)
+        exposition.start_http_server(config['listen-port'], cache)
+        return cache
+    prometheus_client.start_http_server(config['listen-port'],
+                                        registry=refresher or prometheus_client.REGISTRY)
+    return None
+
+def create_collectors(config, snapshots=None):
+    """
+    connect to the configured clouds and regions and create their collectors. If snapshots are
+    given, the collectors publish their metrics there.
+    """
+    if not config['clouds']:
+        return [Collector(config, snapshots=snapshots)]
+    if snapshots is None:
+        # one snapshot of the metrics of all clouds, so every metric family is exposed once
+        snapshots = SnapshotCollector()
+        prometheus_client.REGISTRY.register(snapshots)
+    collectors = []
+    for cloud, region in config['clouds']:
+        LOGGER.info("Connecting to cloud {} region {}".format(cloud or 'from environment', region or 'default'))
+        collectors.append(Collector(config, cloud, region, snapshots))
+    return collectors
+
+def submit_all(collectors):
+    """
+    schedule a run of all collectors, returns their futures
+    """
+    return [collector.submit(api_name) for collector in collectors for api_name in collector.collectors]
+
+def submit_as_leader(lease, collector, api_name):
+    """
+    schedule a run of a collector, unless we are a replica following the leader
+    """
+    if lease is None or lease.is_leader:
+        collector.submit(api_name)
+
+def run_replica(lease, replica_snapshot, collectors):
+    """
+    keep the leader lease, or take it over when the leader is gone, runs forever. Followers load
+    the metrics written by the leader.
+    """
+    while True:
+        was_leader = lease.is_leader
+        try:
+            lease.renew()
+        # pylint: disable=fixme, broad-except
+        except Exception:
+            LOGGER.error("Could not renew the leader lease.")
+            LOGGER.error(traceback.format_exc())
+            lease.is_leader = False
+        if lease.is_leader and not was_leader:
+            LOGGER.info("Took over as leader, collecting.")
+            submit_all(collectors)
+        elif was_leader and not lease.is_leader:
+            LOGGER.warning("Lost the leader lease to {}, following it.".format(lease.holder))
+        if not lease.is_leader:
+            replica_snapshot.load()
+        time.sleep(lease.lease_time / 3)
+
 
 if __name__ == '__main__':
 
@@ -69,58 +217,81 @@ if __name__ == '__main__':
     CONFIG = get_config()
 
     # metrics server that can be polled by prometheus
-    start_http_server(CONFIG['listen-port'])
+    SCRAPE_REFRESH = None
+    if CONFIG['scrape_driven']:
+        SCRAPE_REFRESH = scrape_refresh.ScrapeRefresh(CONFIG['scrape_deadline'])
+    EXPOSITION_CACHE = start_metrics_server(CONFIG, SCRAPE_REFRESH)
+
+    # replicas share one collection: only the leader collects, the followers serve its metrics
+    LEASE = None
+    SNAPSHOTS = None
+    if CONFIG['replica_dir']:
+        LEASE = replica.ReplicaLease(CONFIG['replica_dir'], CONFIG['replica_lease_time'])
+        LEASE.renew()
+        LOGGER.info("Replica {}, leader is {}".format(LEASE.identity, LEASE.holder))
+        SNAPSHOTS = SnapshotCollector()
+
+    with STARTUP_PROFILE.measure('startup: connect and create collectors'):
+        COLLECTORS = create_collectors(CONFIG, SNAPSHOTS)
+    if EXPOSITION_CACHE:
+        for COLLECTOR in COLLECTORS:
+            COLLECTOR.refresh_callbacks.append(EXPOSITION_CACHE.invalidate)
+    if LEASE:
+        REPLICA_SNAPSHOT = replica.ReplicaSnapshot(
+            LEASE, SNAPSHOTS, lambda: not any(COLLECTOR.first_runs_pending for COLLECTOR in COLLECTORS))
+        prometheus_client.REGISTRY.register(REPLICA_SNAPSHOT)
+        for COLLECTOR in COLLECTORS:
+            COLLECTOR.refresh_callbacks.append(REPLICA_SNAPSHOT.write)
+        if EXPOSITION_CACHE:
+            REPLICA_SNAPSHOT.refresh_callbacks.append(EXPOSITION_CACHE.invalidate)
+        if not LEASE.is_leader:
+            REPLICA_SNAPSHOT.load()
 
-    COLLECTOR = Collector(CONFIG)
+    if SCRAPE_REFRESH:
+        SCRAPE_REFRESH.collectors = COLLECTORS
 
     # we use schedule library with threads to make sure it runs at regular intervals
     # see: https://schedule.readthedocs.io/en/stable/parallel-execution.html
-    # we use only one threads for the jobs:
+    # The scheduler hands the collectors to the collectors worker pool. By default the pool has
+    # only one thread:
     # - no need to check if all libs are thread save
     # - do not overload the prodcution cloud when it get's slow for some reason.
+    # See OS_EXPORTER_COLLECTOR_WORKERS to run the collectors in parallel, and
+    # OS_EXPORTER_MAX_IN_FLIGHT_REQUESTS / OS_EXPORTER_MAX_REQUESTS_PER_SECOND to still bound the
+    # load on the cloud then.
+    # Every collector runs at its own interval. If a collector is still running (or waiting
+    # for a worker) when it is due again, that run is skipped instead of queued.
+    # Several clouds or regions are collected concurrently, each on its own worker pool.
+    # In scrape driven mode there are no timers, the scrapes run the collectors whose data is
+    # older than their interval.
+    for COLLECTOR in COLLECTORS:
+        for API_NAME in COLLECTOR.collectors:
+            if CONFIG['scrape_driven']:
+                LOGGER.info("Collecting {} on scrapes, when older than {} seconds".format(API_NAME, COLLECTOR.get_interval(API_NAME)))
+                continue
+            LOGGER.info("Collecting {} every {} seconds".format(API_NAME, COLLECTOR.get_interval(API_NAME)))
+            schedule.every(COLLECTOR.get_interval(API_NAME)).seconds.do(submit_as_leader, LEASE, COLLECTOR, API_NAME)
 
-    # setup job queue and start thread working on it.
-    JOB_QUEUE = queue.Queue()
-    # pylint: disable=fixme, missing-function-docstring
-    def execute_jobs_in_queue():
-        while True:
-            job_func = JOB_QUEUE.get()
-            job_func()
-            JOB_QUEUE.task_done()
-            # we let uncaught exceptions go. They will stop the WORKER_THREAD thread.
-            # The main thread can detect that and will then exit the program
-
-    WORKER_THREAD = threading.Thread(target=execute_jobs_in_queue)
-    WORKER_THREAD.start()
-
-    def job():
-        """
-        have scheduler put jobs into queue in regular intervals forever
-        Note: we only have a single thread -> make sure the interval is not shorter
-        than the time needed to collect the data.
-        """
-        COLLECTOR.refresh()
-        LOGGER.info("job done")
-    schedule.every(int(CONFIG['interval'])).seconds.do(JOB_QUEUE.put, job)
+    # the lease is kept from now on, also while the first collection runs
+    if LEASE:
+        threading.Thread(target=run_replica, args=(LEASE, REPLICA_SNAPSHOT, COLLECTORS),
+                         name="replica", daemon=True).start()
 
     # run immediately (the scheduler schedules the first run only after one interval)
-    try:
-        job()
-    # pylint: disable=fixme, bare-except
-    except:
+    with STARTUP_PROFILE.measure('startup: first collection'):
+        FIRST_RUNS = []
+        if LEASE is None or LEASE.is_leader:
+            FIRST_RUNS = submit_all(COLLECTORS)
+            wait(FIRST_RUNS)
+    # the errors are logged by the collectors, wait() does not raise them
+    if any(FUTURE.exception() for FUTURE in FIRST_RUNS):
         # pylint: disable=fixme, line-too-long
         LOGGER.error("Unhandled exception during data collection, we have to abort. The openstack-exporter probably needs improved error handling...")
-        LOGGER.error(traceback.format_exc())
         sys.exit(3)
+    LOGGER.info("initial collection done")
+    if CONFIG['startup_profile']:
+        STARTUP_PROFILE.uninstall()
+        STARTUP_PROFILE.report()
     while True:
-        LOGGER.debug("Jobqueue length: {}".format(len(JOB_QUEUE.queue)))
-        if len(JOB_QUEUE.queue) > 1:
-            # we are scheduling jobs faster than they can run in a single thread -> we drop one
-            LOGGER.info("dropping one job from schedulers jobqueue.")
-            JOB_QUEUE.get()
-        if not WORKER_THREAD.is_alive():
-            # this may happen if there is an uncaught exception in a job.
-            LOGGER.error("WORKER_THREAD is dead. Exiting...")
-            sys.exit(2)
         schedule.run_pending()
         time.sleep(1)
@@ -0,0 +1,96 @@
+"""
+Directory of keystone projects, used to resolve project ids to names
+"""
+import logging
+import threading
+import time
+import traceback
+
+LOGGER = logging.getLogger(__name__)
+
+# minimal time between two refreshes triggered by unknown project ids
+MISS_REFRESH_INTERVAL = 60
+
+class ProjectDirectory():
+    """
+    project_id -> project name lookup shared by all collectors. All projects are listed with one
+    (paginated) keystone call and kept for `ttl` seconds, lookups are served from memory.
+    Unknown project ids (e.g. resources of deleted projects) are remembered until the next ttl
+    refresh, and counted in the misses counter, if given.
+    """
+    def __init__(
+            self,
+            openstack,
+            ttl,
+            misses=None
+        ):
+        self.openstack = openstack
+        self.ttl = ttl
+        self.misses = misses
+        self.names = {}
+        # project ids not found by a refresh, not looked up again until the next ttl refresh
+        self.unknown = set()
+        # project id -> when it was first looked up, for the ids not yet found or unknown
+        self.missing = {}
+        self.last_refresh = None
+        self.last_full_refresh = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """
+        reload all projects from keystone
+        """
+        names = {}
+        for project in self.openstack.identity.projects():
+            names[project.id] = project.name
+        LOGGER.debug("Loaded {} projects from keystone".format(len(names)))
+        # replace the whole dict, readers always see a complete directory
+        self.names = names
+
+    def _refresh_if_older_than(self, max_age, full=False):
+        """
+        refresh if the last refresh (the last ttl refresh, if full) is older than max_age. Only
+        ttl refreshes forget the unknown project ids.
+        """
+        with self.lock:
+            last_refresh = self.last_full_refresh if full else self.last_refresh
+            if last_refresh is not None and time.monotonic() - last_refresh < max_age:
+                return
+            try:
+                self.refresh()
+            # pylint: disable=fixme, broad-except
+            except Exception:
+                # keep the old names, we try again later
+                LOGGER.error("Could not load projects from keystone.")
+                LOGGER.error(traceback.format_exc())
+            self.last_refresh = time.monotonic()
+            if full:
+                self.last_full_refresh = self.last_refresh
+                self.unknown = set()
+                self.missing = {}
+
+    def name(self, project_id, default='none'):
+        """
+        get the name of a project. Projects created since the last refresh trigger an early
+        refresh, but not more often than every MISS_REFRESH_INTERVAL seconds. Project ids still
+        unknown after a refresh since their first lookup are not looked up again until the next
+        ttl refresh.
+        """
+        started = time.monotonic()
+        self._refresh_if_older_than(self.ttl, full=True)
+        names = self.names
+        if project_id in names:
+            return names[project_id]
+        if project_id not in self.unknown:
+            missing_since = self.missing.setdefault(project_id, started)
+            self._refresh_if_older_than(min(self.ttl, MISS_REFRESH_INTERVAL))
+            if project_id in self.names:
+                self.missing.pop(project_id, None)
+                return self.names[project_id]
+            if self.last_refresh >= missing_since:
+                # not even a refresh since the first lookup knows it
+                self.unknown.add(project_id)
+                self.missing.pop(project_id, None)
+        if self.misses:
+            self.misses.inc()
+        return default
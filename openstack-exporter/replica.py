@@ -0,0 +1,143 @@
+"""
+Coordination of exporter replicas: one leader collects, the followers serve its metrics
+"""
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from prometheus_client.openmetrics.exposition import generate_latest
+from prometheus_client.openmetrics.parser import text_string_to_metric_families
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ReplicaLease():
+    """
+    Leader lease shared by the replicas through a file in a shared directory. The lease is taken
+    and renewed under an exclusive lock (flock) of a lock file, the directory therefore has to
+    support file locks (a local volume shared by containers, or NFS with locking). The holder
+    keeps the lease as long as it renews it within `lease_time` seconds.
+    """
+    def __init__(
+            self,
+            directory,
+            lease_time=30
+        ):
+        self.directory = directory
+        self.lease_time = lease_time
+        self.identity = "{}:{}".format(socket.gethostname(), os.getpid())
+        self.is_leader = False
+        # holder of the lease seen by the last renew()
+        self.holder = None
+
+    def renew(self):
+        """
+        take the lease if it is free or expired, or renew it if we hold it. Returns whether we
+        are the leader.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, 'leader.json')
+        with open(os.path.join(self.directory, 'leader.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(path) as lease_file:
+                    lease = json.load(lease_file)
+            except (OSError, ValueError):
+                lease = {'holder': None, 'expires': 0}
+            if lease['holder'] == self.identity or lease['expires'] < time.time():
+                lease = {'holder': self.identity, 'expires': time.time() + self.lease_time}
+                with open(path + '.tmp', 'w') as lease_file:
+                    json.dump(lease, lease_file)
+                os.replace(path + '.tmp', path)
+        self.holder = lease['holder']
+        self.is_leader = lease['holder'] == self.identity
+        return self.is_leader
+
+
+class ReplicaSnapshot():
+    """
+    Custom prometheus collector for replicas. The leader serves the snapshots of its own
+    collectors and writes them, rendered, to the shared directory after every collection run.
+    The followers serve the last rendering written by the leader, loaded by load().
+
+    Until all collectors of a new leader completed their first run (`ready` returns False), it
+    keeps serving the rendering of the previous leader.
+    """
+    def __init__(
+            self,
+            lease,
+            snapshots,
+            ready
+        ):
+        self.lease = lease
+        self.snapshots = snapshots
+        self.ready = ready
+        self.path = os.path.join(lease.directory, 'metrics.openmetrics')
+        self.lock = threading.Lock()
+        # families of the last rendering loaded, and the modification time of its file
+        self.families = []
+        self.loaded_mtime = None
+        # functions called after a new rendering was loaded, e.g. to invalidate the rendered metrics
+        self.refresh_callbacks = []
+
+    def serves_own(self):
+        """
+        whether the snapshots of our own collectors are served
+        """
+        return self.lease.is_leader and self.ready()
+
+    def write(self):
+        """
+        write the rendered snapshots, if we are the leader. Written to a temporary file first so
+        followers never see a partial one. The OpenMetrics format keeps the types of all families
+        (e.g. info, enum, the _created samples of counters), the classic text format does not.
+        """
+        if not self.serves_own():
+            return
+        with self.lock:
+            try:
+                with open(self.path + '.tmp', 'wb') as snapshot_file:
+                    snapshot_file.write(generate_latest(self.snapshots))
+                os.replace(self.path + '.tmp', self.path)
+            except OSError as exc:
+                LOGGER.warning("Could not write the metrics for the followers: {}".format(exc))
+
+    def load(self):
+        """
+        load the rendering written by the leader, if it changed since it was last loaded
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self.loaded_mtime:
+                return
+            with open(self.path) as snapshot_file:
+                families = list(text_string_to_metric_families(snapshot_file.read()))
+        except FileNotFoundError:
+            return
+        # pylint: disable=fixme, broad-except
+        except Exception:
+            LOGGER.warning("Could not load the metrics of the leader.")
+            LOGGER.debug(traceback.format_exc())
+            return
+        self.families = families
+        self.loaded_mtime = mtime
+        for callback in self.refresh_callbacks:
+            callback()
+
+    def describe(self):
+        """
+        the families are only known after the first collection, don't let the registry check them
+        """
+        return []
+
+    def collect(self):
+        """
+        called by the prometheus client on every scrape
+        """
+        if self.serves_own():
+            return self.snapshots.collect()
+        return self.families
@@ -0,0 +1,149 @@
+"""
+Scheduler bounding the load all collectors together put on the openstack apis
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+# responses telling us to slow down
+BACKOFF_STATUS_CODES = (429, 503)
+# set for threads sending requests that must not be retried
+_LOCAL = threading.local()
+
+
+@contextmanager
+def without_retries():
+    """
+    requests sent by the current thread inside this context are not retried, e.g. api state
+    probes, which should report a struggling api rather than wait for it
+    """
+    _LOCAL.no_retries = True
+    try:
+        yield
+    finally:
+        _LOCAL.no_retries = False
+
+
+def retry_after_seconds(response):
+    """
+    the delay requested by the Retry-After header of a response (seconds or http date), or None
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler():
+    """
+    Every api request waits here for a free slot before it is sent. The scheduler enforces a
+    global and a per api maximum of requests in flight, a global requests per second limit
+    (token bucket, bursts of up to one second worth of requests) and backs off an api after it
+    answered with 429 or 503. A limit of 0 means no limit.
+    """
+    # pylint: disable=fixme, too-many-arguments, too-many-instance-attributes
+    def __init__(
+            self,
+            max_in_flight=0,
+            api_max_in_flight=None,
+            max_requests_per_second=0,
+            retries=0,
+            max_backoff=60
+        ):
+        self.global_slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self.api_max_in_flight = api_max_in_flight or {}
+        self.retries = retries
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        # api -> semaphore, created on first use
+        self.api_slots = {}
+        self.rate = max_requests_per_second
+        self.burst = max(1.0, self.rate)
+        self.tokens = self.burst
+        self.tokens_updated = time.monotonic()
+        # api -> monotonic time until which no requests are sent
+        self.backoff_until = {}
+
+    def _api_slots(self, api):
+        with self.lock:
+            if api not in self.api_slots:
+                limit = self.api_max_in_flight.get(api)
+                self.api_slots[api] = threading.BoundedSemaphore(limit) if limit else None
+            return self.api_slots[api]
+
+    def _wait_for_backoff(self, api):
+        while True:
+            with self.lock:
+                delay = self.backoff_until.get(api, 0) - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def _take_token(self):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.tokens_updated) * self.rate)
+            self.tokens_updated = now
+            # the token is taken right away, a negative balance is the queue of waiting requests
+            self.tokens -= 1
+            delay = -self.tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+    @contextmanager
+    def slot(self, api):
+        """
+        context manager holding a slot for one request to the given api. Yields how long the
+        request had to wait for it.
+        """
+        start = time.monotonic()
+        self._wait_for_backoff(api)
+        api_slots = self._api_slots(api)
+        if api_slots:
+            api_slots.acquire()
+        try:
+            if self.global_slots:
+                self.global_slots.acquire()
+            try:
+                self._take_token()
+                yield time.monotonic() - start
+            finally:
+                if self.global_slots:
+                    self.global_slots.release()
+        finally:
+            if api_slots:
+                api_slots.release()
+
+    def request_retries(self):
+        """
+        how often the request about to be sent by the current thread may be retried
+        """
+        if getattr(_LOCAL, 'no_retries', False):
+            return 0
+        return self.retries
+
+    def backoff(self, api, attempt, retry_after=None):
+        """
+        stop sending requests to the api for a while, after it answered attempt (counted from 0)
+        of a request with 429 or 503. Without retry_after the delay grows exponentially (with
+        jitter) with the attempts of that request, so it is bounded by the retries of a single
+        request. Returns the delay.
+        """
+        if retry_after is None:
+            delay = min(self.max_backoff, 2 ** attempt) * random.uniform(0.5, 1)
+        else:
+            delay = min(self.max_backoff, retry_after)
+        with self.lock:
+            self.backoff_until[api] = max(self.backoff_until.get(api, 0), time.monotonic() + delay)
+        return delay
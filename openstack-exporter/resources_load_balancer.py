@@ -0,0 +1,31 @@
+"""
+Octavia resources listed with only the fields the load balancer collector uses
+"""
+from openstack import resource
+from openstack.load_balancer.v2 import (
+    amphora, health_monitor, listener, load_balancer, member, pool)
+
+
+class LoadBalancer(load_balancer.LoadBalancer):
+    # older sdk versions do not map the fields query parameter
+    _query_mapping = resource.QueryParameters('fields')
+
+
+class Listener(listener.Listener):
+    _query_mapping = resource.QueryParameters('fields')
+
+
+class Pool(pool.Pool):
+    _query_mapping = resource.QueryParameters('fields')
+
+
+class Member(member.Member):
+    _query_mapping = resource.QueryParameters('fields')
+
+
+class HealthMonitor(health_monitor.HealthMonitor):
+    _query_mapping = resource.QueryParameters('fields')
+
+
+class Amphora(amphora.Amphora):
+    _query_mapping = resource.QueryParameters('fields')
@@ -0,0 +1,14 @@
+"""
+Neutron resources listed with only the fields the network collector uses
+"""
+from openstack import resource
+from openstack.network.v2 import floating_ip, router
+
+
+class FloatingIP(floating_ip.FloatingIP):
+    # older sdk versions do not map the fields query parameter
+    _query_mapping = resource.QueryParameters('fields')
+
+
+class Router(router.Router):
+    _query_mapping = resource.QueryParameters('fields')
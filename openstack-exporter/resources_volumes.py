@@ -120,3 +120,9 @@ class Volume(resource.Resource):
 
 
 VolumeDetail = Volume
+
+
+class ChangedVolume(Volume):
+    # Filtering by updated_at with an operator (e.g. updated_at=gte:2021-01-01T00:00:00)
+    # is available as of microversion 3.60
+    _max_microversion = '3.60'
@@ -0,0 +1,59 @@
+"""
+Scrape driven collection: scrapes refresh the collections that are too old
+"""
+import logging
+import time
+from concurrent.futures import wait
+from prometheus_client import REGISTRY
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ScrapeRefresh():
+    """
+    Registry wrapper served instead of the registry. Before a scrape is served, every collector
+    whose last completed run is older than its interval is run. Collector.submit() coalesces
+    concurrent scrapes into the run in progress. The scrape waits for the runs at most `deadline`
+    seconds, collectors not done by then are served from their last snapshot and keep running
+    for the next scrape.
+    """
+    def __init__(
+            self,
+            deadline=5,
+            registry=REGISTRY
+        ):
+        self.deadline = deadline
+        self.registry = registry
+        # set once the collectors are created
+        self.collectors = []
+
+    def refresh(self):
+        """
+        run the collectors with old data and wait for them until the deadline
+        """
+        futures = []
+        now = time.monotonic()
+        for collector in self.collectors:
+            for api_name in collector.collectors:
+                collected = collector.collected.get(api_name)
+                if collected is None or now - collected >= collector.get_interval(api_name):
+                    futures.append(collector.submit(api_name))
+        if futures:
+            _, not_done = wait(futures, timeout=self.deadline)
+            if not_done:
+                LOGGER.info("{} collections did not finish within the scrape deadline, serving "
+                            "their last snapshot.".format(len(not_done)))
+
+    def collect(self):
+        """
+        called by the prometheus client on every scrape
+        """
+        self.refresh()
+        return self.registry.collect()
+
+    def restricted_registry(self, names):
+        """
+        scrapes asking for some metrics only (name[] parameters)
+        """
+        self.refresh()
+        return self.registry.restricted_registry(names)
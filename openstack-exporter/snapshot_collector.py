@@ -0,0 +1,67 @@
+"""
+Snapshot based prometheus collector, serves metrics of complete collection runs only
+"""
+import threading
+from prometheus_client.metrics_core import Metric
+
+
+def take_snapshot(registry, sample_filter=None, labels=None):
+    """
+    collect all metric families of a registry. If a sample_filter is given, only samples for which
+    it returns True are kept. If labels are given, they are added to all samples (e.g. the cloud
+    and region the metrics come from).
+    """
+    families = []
+    for family in registry.collect():
+        if sample_filter:
+            samples = [sample for sample in family.samples if sample_filter(sample)]
+            if not samples:
+                continue
+            family.samples = samples
+        if labels:
+            family.samples = [sample._replace(labels=dict(labels, **sample.labels))
+                              for sample in family.samples]
+        families.append(family)
+    return families
+
+
+class SnapshotCollector():
+    """
+    Custom prometheus collector yielding published snapshots. The collectors update their own
+    private registries and publish a snapshot of them when a collection run is done. A scrape
+    therefore never sees a half updated collection run and does not need any of the locks of the
+    metrics being updated.
+    """
+    def __init__(self):
+        self.parts = {}
+        self.families = []
+        self.lock = threading.Lock()
+
+    def publish(self, key, families):
+        """
+        replace the snapshot part published under key. Families with the same name from different
+        parts are merged so every family is exposed only once.
+        """
+        with self.lock:
+            self.parts[key] = families
+            merged = {}
+            for part in self.parts.values():
+                for family in part:
+                    if family.name not in merged:
+                        merged[family.name] = Metric(
+                            family.name, family.documentation, family.type, family.unit)
+                    merged[family.name].samples.extend(family.samples)
+            # single reference swap, scrapes see either the old or the new snapshot
+            self.families = list(merged.values())
+
+    def describe(self):
+        """
+        the families are only known after the first collection, don't let the registry check them
+        """
+        return []
+
+    def collect(self):
+        """
+        called by the prometheus client on every scrape
+        """
+        return self.families
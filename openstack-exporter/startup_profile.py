@@ -0,0 +1,133 @@
+"""
+Startup profile: time and memory spent importing modules and in the startup phases
+"""
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+
+def current_rss():
+    """
+    resident memory of the process in bytes (peak resident memory where /proc is missing)
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class TimedLoader():
+    """
+    wraps the loader of a module to measure its execution
+    """
+    def __init__(
+            self,
+            loader,
+            profile
+        ):
+        self.loader = loader
+        self.profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        """
+        create the module with the wrapped loader
+        """
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        """
+        execute the module with the wrapped loader, measured
+        """
+        with self.profile.measure(module.__name__):
+            self.loader.exec_module(module)
+
+
+class StartupProfile():
+    """
+    Records time and resident memory growth of the startup phases and, once installed as import
+    hook, of every imported module. Both are recorded inclusive and exclusive of what is
+    measured within (e.g. the modules a module imports).
+    """
+    def __init__(self):
+        # name -> [seconds, own seconds, rss growth, own rss growth]
+        self.records = {}
+        # per thread: [seconds, rss growth] measured within the measurements in progress
+        self.local = threading.local()
+
+    def install(self):
+        """
+        measure all imports from now on
+        """
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        """
+        stop measuring imports
+        """
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path=None, target=None):
+        """
+        meta path finder hook: find the module with the other finders and wrap its loader
+        """
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    @contextmanager
+    def measure(self, name):
+        """
+        context manager measuring a phase or the import of a module
+        """
+        stack = self.local.__dict__.setdefault('stack', [])
+        start = time.perf_counter()
+        start_rss = current_rss()
+        stack.append([0.0, 0])
+        try:
+            yield
+        finally:
+            inner_seconds, inner_rss = stack.pop()
+            seconds = time.perf_counter() - start
+            rss = current_rss() - start_rss
+            self.records[name] = [seconds, seconds - inner_seconds, rss, rss - inner_rss]
+            if stack:
+                stack[-1][0] += seconds
+                stack[-1][1] += rss
+
+    def report(self, limit=25):
+        """
+        log the modules (and phases) that took most time, and the totals per top level package
+        """
+        packages = {}
+        for name, (_, own_seconds, _, own_rss) in self.records.items():
+            package = packages.setdefault(name.split('.')[0], [0.0, 0])
+            package[0] += own_seconds
+            package[1] += own_rss
+        LOGGER.info("Startup profile, RSS now {:.1f} MB".format(current_rss() / 2**20))
+        LOGGER.info("{:<50} {:>10} {:>10} {:>10} {:>10}".format(
+            'module / phase', 'ms', 'own ms', 'KB', 'own KB'))
+        for name, (seconds, own_seconds, rss, own_rss) in sorted(
+                self.records.items(), key=lambda record: -record[1][1])[0:limit]:
+            LOGGER.info("{:<50} {:>10.1f} {:>10.1f} {:>10} {:>10}".format(
+                name, seconds * 1000, own_seconds * 1000, rss // 1024, own_rss // 1024))
+        LOGGER.info("{:<50} {:>10} {:>10}".format('package', 'own ms', 'own KB'))
+        for name, (own_seconds, own_rss) in sorted(
+                packages.items(), key=lambda package: -package[1][0])[0:limit]:
+            LOGGER.info("{:<50} {:>10.1f} {:>10}".format(name, own_seconds * 1000, own_rss // 1024))
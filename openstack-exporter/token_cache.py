@@ -0,0 +1,106 @@
+"""
+Keystone token handling: reuse of tokens across restarts and re-authentication before expiry
+"""
+import hashlib
+import logging
+import os
+import threading
+import traceback
+
+LOGGER = logging.getLogger(__name__)
+
+class TokenCache():
+    """
+    Keeps the keystone token of the openstack connection valid. The token is renewed between
+    collection runs once it expires within `refresh_margin` seconds (at most half its lifetime),
+    instead of by the first failing request of a run.
+
+    If a directory is given, the token (with its service catalog) is stored there, readable by the
+    owner only, and reused by the next start of the exporter while it is still valid.
+    """
+    def __init__(
+            self,
+            openstack,
+            directory=None,
+            refresh_margin=900
+        ):
+        self.openstack = openstack
+        self.directory = directory
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+        self.auth = openstack.session.auth
+        if not hasattr(self.auth, 'get_auth_state'):
+            LOGGER.warning("Auth plugin {} can not store its token, token cache disabled.".
+                           format(type(self.auth).__name__))
+            self.directory = None
+
+    def path(self):
+        """
+        cache file of the current credentials, named after the auth plugin cache id
+        """
+        name = hashlib.sha256(self.auth.get_cache_id().encode()).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    def _expires_soon(self):
+        auth_ref = self.auth.auth_ref
+        if auth_ref is None:
+            return True
+        margin = self.refresh_margin
+        if auth_ref.expires and auth_ref.issued:
+            margin = min(margin, (auth_ref.expires - auth_ref.issued).total_seconds() / 2)
+        return auth_ref.will_expire_soon(margin)
+
+    def load(self):
+        """
+        use the stored token, if there is one and it is still valid for a while
+        """
+        if not self.directory:
+            return False
+        try:
+            with open(self.path()) as cache_file:
+                self.auth.set_auth_state(cache_file.read())
+        except FileNotFoundError:
+            return False
+        # pylint: disable=fixme, broad-except
+        except Exception:
+            LOGGER.warning("Could not load the cached token.")
+            LOGGER.debug(traceback.format_exc())
+            self.auth.invalidate()
+            return False
+        if self._expires_soon():
+            LOGGER.info("Cached token expires soon, authenticating.")
+            self.auth.invalidate()
+            return False
+        LOGGER.info("Using cached token valid until {}".format(self.auth.auth_ref.expires))
+        return True
+
+    def save(self):
+        """
+        store the current token, written to a temporary file first so readers never see a
+        partial one
+        """
+        if not self.directory or self.auth.auth_ref is None:
+            return
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            path = self.path()
+            temporary_path = path + '.tmp'
+            descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, 'w') as cache_file:
+                cache_file.write(self.auth.get_auth_state())
+            os.replace(temporary_path, path)
+        except OSError as exc:
+            # the exporter works without the cache
+            LOGGER.warning("Could not store the token: {}".format(exc))
+
+    def refresh(self):
+        """
+        authenticate if there is no token yet or it expires soon, and store the new token
+        """
+        with self.lock:
+            if not self._expires_soon():
+                return
+            LOGGER.info("Token expires soon, authenticating.")
+            self.auth.invalidate()
+            self.auth.get_access(self.openstack.session)
+            self.save()
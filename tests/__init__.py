@@ -0,0 +1,22 @@
+"""
+Tests of the openstack exporter. The exporter modules are not a package, they are imported from
+the openstack-exporter directory like the exporter does.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'openstack-exporter'))
+
+
+def shared_metrics():
+    """
+    the metrics a Collector shares with its api collectors, in a registry of their own
+    """
+    # pylint: disable=fixme, import-outside-toplevel
+    import types
+    from prometheus_client import CollectorRegistry
+    from collector import Collector
+    holder = types.SimpleNamespace(name_prefix='test_', registry=CollectorRegistry())
+    Collector.init_metrics(holder)
+    return holder.metrics
@@ -0,0 +1,82 @@
+"""
+Cinder collector
+"""
+import datetime
+import types
+import unittest
+from unittest import mock
+from openstack.exceptions import ResourceNotFound
+from collector_api_block_storage import CollectorAPIBlockStorage
+from resources_volumes import ChangedVolume
+from tests import shared_metrics
+
+
+def volume(volume_id, status, age):
+    """
+    a volume as listed by cinder, last updated age seconds ago
+    """
+    updated_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=age)
+    return types.SimpleNamespace(id=volume_id, name=volume_id, project_id='project', status=status,
+                                 updated_at=updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f'))
+
+
+class TestStuckVolumes(unittest.TestCase):
+    """
+    volumes in a transitional status for too long
+    """
+    def setUp(self):
+        config = {'snapshot_mode': True, 'block_storage': {
+            'volumes_detail': 'problems', 'volumes_stuck_time': 300,
+            'volumes_full_sync_interval': 3600}}
+        self.openstack = mock.MagicMock()
+        self.openstack.block_storage.get_endpoint_data.return_value.max_microversion = (3, 60)
+        self.all_volumes = []
+        self.changed_volumes = []
+        self.openstack.block_storage._list.side_effect = lambda resource, **kwargs: list(
+            self.changed_volumes if resource is ChangedVolume else self.all_volumes)
+        self.collector = CollectorAPIBlockStorage(
+            config, self.openstack, shared_metrics(), 'block-storage', 'cinderv3', 'test_',
+            discovery_cache=mock.MagicMock(loaded=True))
+
+    def stuck_seconds(self, volume_id, status):
+        return self.collector.registry.get_sample_value(
+            'test_block_storage_volume_stuck_seconds',
+            {'id': volume_id, 'name': volume_id, 'project_id': 'project', 'status': status})
+
+    def volumes(self, status):
+        return self.collector.registry.get_sample_value(
+            'test_block_storage_volumes', {'status': status})
+
+    def test_deleted_stuck_volume_vanishes_in_incremental_mode(self):
+        self.all_volumes = [volume('v1', 'deleting', 600), volume('v2', 'available', 600)]
+        self.collector.collect_api_specific_data()
+        self.assertGreaterEqual(self.stuck_seconds('v1', 'DELETING'), 600)
+
+        # the volume is deleted: gone from the listings, the changed volumes don't have it
+        self.all_volumes = [volume('v2', 'available', 600)]
+        self.openstack.block_storage._get.side_effect = ResourceNotFound()
+        self.collector.collect_api_specific_data()
+        self.assertIsNone(self.stuck_seconds('v1', 'DELETING'))
+        self.assertEqual(self.volumes('DELETING'), 0)
+        self.assertEqual(self.volumes('AVAILABLE'), 1)
+        self.assertNotIn('v1', self.collector.data['volumes'])
+
+    def test_stuck_volume_is_confirmed_in_incremental_mode(self):
+        self.all_volumes = [volume('v1', 'deleting', 600)]
+        self.collector.collect_api_specific_data()
+        self.openstack.block_storage._get.return_value = volume('v1', 'deleting', 600)
+        self.collector.collect_api_specific_data()
+        self.assertGreaterEqual(self.stuck_seconds('v1', 'DELETING'), 600)
+        self.assertEqual(self.openstack.block_storage._get.call_count, 1)
+
+    def test_listed_stuck_volumes_are_not_fetched(self):
+        self.all_volumes = [volume('v1', 'creating', 600)]
+        self.collector.collect_api_specific_data()
+        self.changed_volumes = [volume('v1', 'creating', 600)]
+        self.collector.collect_api_specific_data()
+        self.assertGreaterEqual(self.stuck_seconds('v1', 'CREATING'), 600)
+        self.openstack.block_storage._get.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
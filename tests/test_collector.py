@@ -0,0 +1,34 @@
+"""
+Collector of all apis of a cloud
+"""
+import unittest
+from unittest import mock
+from collector import Collector
+
+
+class TestRediscover(unittest.TestCase):
+    """
+    services discovered again in the background
+    """
+    def collector(self, services):
+        collector = Collector.__new__(Collector)
+        collector.config = {'api-exclude': ['designate']}
+        collector.collectors = {'compute': mock.MagicMock()}
+        collector.discovery_cache = mock.MagicMock()
+        collector.discovery_cache.discover_services.return_value = services
+        return collector
+
+    def test_excluded_services_are_not_new(self):
+        collector = self.collector([('nova', 'compute'), ('designate', 'dns')])
+        with self.assertNoLogs('collector', 'INFO'):
+            collector.rediscover()
+
+    def test_new_services_are_logged(self):
+        collector = self.collector([('nova', 'compute'), ('glance', 'image')])
+        with self.assertLogs('collector', 'INFO') as logs:
+            collector.rediscover()
+        self.assertIn("{'image'}", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Neutron collector
+"""
+import types
+import unittest
+from unittest import mock
+from openstack.exceptions import ForbiddenException
+from collector_api_network import CollectorAPINetwork
+from tests import shared_metrics
+
+
+def availability(network_id, used_ips):
+    """
+    ip availability of a network with one subnet
+    """
+    return types.SimpleNamespace(
+        network_id=network_id, network_name=network_id, project_id='project', total_ips=250,
+        used_ips=used_ips, subnet_ip_availability=[{
+            'subnet_id': network_id + '-subnet', 'subnet_name': 'subnet', 'cidr': '10.0.0.0/24',
+            'total_ips': 250, 'used_ips': used_ips}])
+
+
+class TestIpAvailability(unittest.TestCase):
+    """
+    ip availability of the networks and subnets
+    """
+    def setUp(self):
+        config = {'snapshot_mode': True, 'network': {
+            'collect_ip_availability': True, 'ip_availability_interval': 300}}
+        self.openstack = mock.MagicMock()
+        self.openstack.network._list.return_value = []
+        self.collector = CollectorAPINetwork(
+            config, self.openstack, shared_metrics(), 'network', 'neutron', 'test_',
+            discovery_cache=mock.MagicMock(loaded=True))
+
+    def used_ips(self, network_id):
+        return self.collector.registry.get_sample_value(
+            'test_network_network_ips_used',
+            {'network_id': network_id, 'network_name': network_id, 'project_id': 'project'})
+
+    def test_failing_listing_keeps_the_last_values(self):
+        listing = self.openstack.network.network_ip_availabilities
+        listing.return_value = [availability('net1', 10)]
+        self.collector.collect_api_specific_data()
+        self.assertEqual(self.used_ips('net1'), 10)
+
+        def forbidden():
+            yield availability('net2', 20)
+            raise ForbiddenException("Policy doesn't allow get_network_ip_availability")
+        listing.side_effect = forbidden
+        self.collector.data['ip_availability_updated'] = None
+        with self.assertLogs('collector_api_network', 'WARNING') as logs:
+            self.collector.collect_api_specific_data()
+            # the next failure is not logged as warning again
+            self.collector.data['ip_availability_updated'] = None
+            self.collector.collect_api_specific_data()
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(self.used_ips('net1'), 10)
+        self.assertEqual(listing.call_count, 3)
+
+        # the label sets of the failed listings don't keep removed networks
+        listing.side_effect = None
+        listing.return_value = [availability('net3', 30)]
+        self.collector.data['ip_availability_updated'] = None
+        self.collector.collect_api_specific_data()
+        self.assertIsNone(self.used_ips('net1'))
+        self.assertIsNone(self.used_ips('net2'))
+        self.assertEqual(self.used_ips('net3'), 30)
+
+    def test_failures_are_retried_after_the_interval(self):
+        listing = self.openstack.network.network_ip_availabilities
+        listing.side_effect = ForbiddenException("Policy doesn't allow get_network_ip_availability")
+        self.collector.collect_api_specific_data()
+        self.collector.collect_api_specific_data()
+        self.assertEqual(listing.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Request scheduler and the retries of the instrumented http adapter
+"""
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import requests
+from api_instrumentation import InstrumentedHTTPAdapter
+from request_scheduler import RequestScheduler, without_retries
+
+
+class BusyHandler(BaseHTTPRequestHandler):
+    """
+    answers every request with 503 and a Retry-After header
+    """
+    requests = 0
+
+    # pylint: disable=fixme, invalid-name
+    def do_GET(self):
+        BusyHandler.requests += 1
+        self.send_response(503)
+        self.send_header('Retry-After', '30')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # pylint: disable=fixme, redefined-builtin
+    def log_message(self, format, *args):
+        pass
+
+
+class Resolver():
+    """
+    resolves every url to the same api and endpoint
+    """
+    # pylint: disable=fixme, no-self-use
+    def resolve(self, url):
+        return 'compute', '/'
+
+
+class TestBackoff(unittest.TestCase):
+    """
+    429 and 503 answers back off the api, whether or not the request is retried
+    """
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), BusyHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+        BusyHandler.requests = 0
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def session(self, scheduler):
+        session = requests.Session()
+        session.mount('http://', InstrumentedHTTPAdapter(mock.MagicMock(), Resolver(), scheduler))
+        return session
+
+    def test_backoff_without_retries(self):
+        scheduler = RequestScheduler(retries=0, max_backoff=60)
+        response = self.session(scheduler).get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(BusyHandler.requests, 1)
+        # Retry-After is honoured
+        self.assertGreater(scheduler.backoff_until['compute'], time.monotonic() + 25)
+
+    def test_backoff_capped_by_max_backoff(self):
+        scheduler = RequestScheduler(retries=0, max_backoff=2)
+        self.session(scheduler).get(self.url)
+        self.assertLessEqual(scheduler.backoff_until['compute'], time.monotonic() + 2)
+
+    def test_probes_back_off_without_retries(self):
+        scheduler = RequestScheduler(retries=3, max_backoff=60)
+        with without_retries():
+            self.session(scheduler).get(self.url)
+        self.assertEqual(BusyHandler.requests, 1)
+        self.assertIn('compute', scheduler.backoff_until)
+
+    def test_retries_grow_with_the_attempts_of_the_request(self):
+        scheduler = RequestScheduler(retries=2)
+        with mock.patch('random.uniform', return_value=1):
+            delays = [scheduler.backoff('compute', attempt) for attempt in range(3)]
+        self.assertEqual(delays, [1, 2, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()